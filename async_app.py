@@ -0,0 +1,807 @@
+"""
+******************************************************************
+
+        File name   : async_app.py
+        Description : asyncio based server for the same API as app.py
+
+                      Every client driver is a WhatsAPIDriverAsync,
+                      selenium calls run on the driver's own executor
+                      while requests waiting on them are coroutines,
+                      not threads. Message processing, webhooks and
+                      R2MP forwarding are shared with app.py
+
+                      Cluster mode is app.py only: the /admin/cluster,
+                      /admin/clients/<id>/migrate,
+                      /admin/cluster/rebalance and /admin/sessions/<id>
+                      routes move sessions between the threaded drivers
+                      of app.py and are not served here
+
+                      Run with: python async_app.py
+
+        Requirements: Mentioned in requirements.txt
+
+*****************************************************************/
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import sys
+from functools import partial, wraps
+
+from aiohttp import web
+from selenium.common.exceptions import NoSuchElementException, WebDriverException
+
+import app as api
+from client_state import ClientState
+from message_listener import MessageListener
+from session_restore import RestoreScheduler
+from webwhatsapi import WhatsAPIDriverStatus
+from webwhatsapi.async_driver import WhatsAPIDriverAsync
+
+logger = api.logger
+
+# Seconds a logged out client waits between two status probes
+CLIENT_IDLE_INTERVAL = 2
+# Seconds between two QR codes sent to the webhook while waiting for a login
+LOGIN_QR_INTERVAL = 5
+# Seconds to wait for the user to scan the QR code
+LOGIN_WAIT_TIMEOUT = 600
+# Seconds a browser changing route waits for the previous one of the same client
+BROWSER_LOCK_TIMEOUT = 10
+
+HOST = "0.0.0.0"
+PORT = 8888
+
+# Store all AsyncClient objects for each client user
+clients = dict()
+# Locks making sure a client only ever gets one driver
+client_init_locks = dict()
+
+"""
+##############################
+##### CLASS DEFINITION #######
+##############################
+"""
+
+
+class AsyncClient(object):
+    """Driver of a client user together with the tasks working on it"""
+
+    def __init__(self, client_id, driver):
+        self.client_id = client_id
+        self.driver = driver
+        self.state = ClientState(client_id)
+        # Held while a route changes the browser state, like app.py semaphores
+        self.browser_lock = asyncio.Lock()
+        self.listener = None
+        self.login_watcher = None
+
+    @property
+    def is_listening(self):
+        return self.listener is not None and not self.listener.done()
+
+    def start_listener(self):
+        if not self.is_listening:
+            self.listener = asyncio.ensure_future(run_client(self))
+
+    def start_login_watcher(self):
+        if self.login_watcher is None or self.login_watcher.done():
+            self.login_watcher = asyncio.ensure_future(watch_login(self))
+
+    async def close(self):
+        for task in (self.listener, self.login_watcher):
+            if task is not None:
+                task.cancel()
+        await self.driver.quit()
+
+
+"""
+##############################
+##### FUNCTION DEFINITION ####
+##############################
+"""
+
+
+def dumps(obj):
+    return json.dumps(obj, cls=api.WhatsAPIJSONEncoder)
+
+
+def jsonify(obj, status=200):
+    return web.json_response(obj, status=status, dumps=dumps)
+
+
+def run_in_executor(function, *args, **kwargs):
+    """Run a blocking function of app.py on the default executor
+
+    @param function: function to run
+    @return awaitable result of the function
+    """
+    return asyncio.get_event_loop().run_in_executor(None, partial(function, *args, **kwargs))
+
+
+async def create_driver(client_id):
+    """Launch the browser of a client and open WhatsApp web
+
+    @param client_id: ID of client user
+    @return WhatsAPIDriverAsync object
+    """
+    loop = asyncio.get_event_loop()
+    # Starting chrome blocks for seconds, keep it off the loop. A standby driver from the pool is
+    # taken when one is ready, see api.init_driver
+    driver = await loop.run_in_executor(None, api.init_driver, client_id)
+    return WhatsAPIDriverAsync(driver=driver, loop=loop)
+
+
+async def init_client(client_id):
+    """Initialise a driver for client and store for future reference
+
+    @param client_id: ID of client user
+    @return AsyncClient object
+    """
+    if client_id not in clients:
+        # Concurrent requests for a new client wait for the first one to launch its driver
+        async with client_init_locks.setdefault(client_id, asyncio.Lock()):
+            if client_id not in clients:
+                logger.info("About to initialise new driver ")
+                client = AsyncClient(client_id, await create_driver(client_id))
+                await refresh_client_state(client)
+                client.start_listener()
+                clients[client_id] = client
+    return clients[client_id]
+
+
+async def delete_client(client_id, preserve_cache):
+    """Delete all objects related to client
+
+    @param client_id: ID of client user
+    @param preserve_cache: Boolean, whether to delete the chrome profile folder or not
+    """
+    if client_id in clients:
+        await clients.pop(client_id).close()
+
+    if not preserve_cache:
+        logger.info("Deleting the profile folder for app Id")
+        shutil.rmtree(api.CHROME_CACHE_PATH + client_id, ignore_errors=True)
+
+
+async def refresh_client_state(client):
+    """Probe the driver of a client and move its state along
+
+    @param client: AsyncClient object
+    @return current WhatsAPIDriverStatus
+    """
+    try:
+        status = await client.driver.get_status()
+    except WebDriverException:
+        status = WhatsAPIDriverStatus.NotConnected
+    client.state.update(status)
+    return status
+
+
+async def run_client(client):
+    """Keep the state of a client up to date and hand its new messages over to
+    app.py message processing. Runs as long as the client exists
+
+    @param client: AsyncClient object
+    """
+    loop = asyncio.get_event_loop()
+    next_probe = 0
+    swept = None
+    while True:
+        try:
+            if loop.time() >= next_probe:
+                await refresh_client_state(client)
+                next_probe = loop.time() + api.CLIENT_STATUS_INTERVAL
+
+            if client.state.status != WhatsAPIDriverStatus.LoggedIn:
+                swept = None
+                await asyncio.sleep(CLIENT_IDLE_INTERVAL)
+                continue
+
+            if swept is None:
+                # Messages left unread before the page loaded never reach the buffer of the page
+                message_groups = await client.driver.get_unread(mark_seen=True)
+                if message_groups:
+                    await run_in_executor(api.handle_new_messages, client.client_id, message_groups, False)
+                swept = set(message.id for message_group in message_groups for message in message_group.messages)
+
+            # Short wait inside the browser, the single browser worker is free for sends between two waits
+            message_groups = MessageListener.drop_swept(
+                await client.driver.get_new_message_groups(api.INBOUND_WAIT_TIMEOUT), swept)
+            if message_groups:
+                await run_in_executor(api.handle_new_messages, client.client_id, message_groups)
+            else:
+                await asyncio.sleep(api.INBOUND_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Message listener of client " + client.client_id + " failed")
+            next_probe = 0
+            swept = None
+            await asyncio.sleep(CLIENT_IDLE_INTERVAL)
+
+
+async def post_webhook(body):
+    """Send a login event of a client to the webhook
+
+    @param body: JSON body of the event
+    """
+    response = await run_in_executor(api.http_client.post, api.WEBHOOK + '/api/v1/whatsapp/webhook', json=body)
+    logger.info("Sending " + ("login" if body["isLoggedIn"] else "QR") + " to server " + str(api.WEBHOOK) + " " +
+                str(response))
+    return response
+
+
+async def watch_login(client):
+    """Send the QR code to the webhook until the user logs in, then send the
+    phone number of the user
+
+    @param client: AsyncClient object
+    """
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + LOGIN_WAIT_TIMEOUT
+    while loop.time() < deadline:
+        try:
+            if await client.driver.is_logged_in():
+                break
+            qr = await client.driver.get_qr_base64()
+            await post_webhook({
+                'success': True,
+                'appId': client.client_id,
+                'isLoggedIn': False,
+                'qr': qr
+            })
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Failed to send QR of client " + client.client_id)
+        await asyncio.sleep(LOGIN_QR_INTERVAL)
+    else:
+        logger.info("Scan Code TimeOut for client " + client.client_id)
+        return
+
+    logger.info("Driver Logged In")
+    client.driver.invalidate_status()
+    await refresh_client_state(client)
+    phone = (await client.driver.get_id()).replace("\"", "").replace("@c.us", "")
+    await client.driver.save_sessions()
+    await post_webhook({
+        'success': True,
+        'isLoggedIn': True,
+        'appId': client.client_id,
+        "msisdn": phone,
+        "qr": None
+    })
+
+
+async def restore_sessions(app):
+    """Start the drivers of all clients with a chrome profile, a few at a time, most recently active first"""
+    logger.info("Finding connected whatsApp Companies")
+    connected_companies = api.list_saved_sessions()
+    logger.info(str(len(connected_companies)) + " Connected WhatsApp Companies retrieved " + str(connected_companies))
+
+    concurrency = api.get_restore_concurrency()
+    api.restore_scheduler.track(connected_companies, concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def restore(client_id):
+        async with semaphore:
+            api.restore_scheduler.set_state(client_id, RestoreScheduler.RESTORING)
+            try:
+                client = await init_client(client_id)
+                api.restore_scheduler.set_state(client_id, RestoreScheduler.RESTORED)
+                logger.info("Session of client " + client_id + " restored, status " + client.state.status)
+            except Exception as e:
+                api.restore_scheduler.set_state(client_id, RestoreScheduler.FAILED, str(e))
+                logger.exception("Session Restoration for client " + client_id + " failed")
+
+    # Tasks are created in order, the semaphore lets them through in that order
+    await asyncio.gather(*[restore(client_id) for client_id in connected_companies])
+
+
+def login_required(f):
+    @wraps(f)
+    async def decorated_function(request):
+        if request["driver_status"] != WhatsAPIDriverStatus.LoggedIn:
+            return jsonify({"error": "client is not logged in"})
+        return await f(request)
+
+    return decorated_function
+
+
+def browser_exclusive(f):
+    """Hold the client's browser lock while the route runs. Only for routes
+    that change the browser state, other routes never wait for them"""
+    @wraps(f)
+    async def decorated_function(request):
+        lock = request["client"].browser_lock
+        try:
+            await asyncio.wait_for(lock.acquire(), BROWSER_LOCK_TIMEOUT)
+        except asyncio.TimeoutError:
+            return jsonify({"error": "client is busy, try again later"}, 503)
+        try:
+            return await f(request)
+        finally:
+            lock.release()
+
+    return decorated_function
+
+
+@web.middleware
+async def before_request(request, handler):
+    """Async counterpart of app.py before_request: checks the auth-key and
+    client_id headers and makes sure the client has a driver
+
+    Required paramters for an API hit are:
+    auth-key: key string to identify valid request
+    client_id: to identify for which client the request is to be run
+    """
+    if request.match_info.http_exception is not None:
+        raise request.match_info.http_exception
+
+    logger.info("API call " + request.method + " " + str(request.url))
+
+    auth_key = request.headers.get("auth-key")
+    client_id = request.headers.get("client_id")
+    rule_parent = request.path.split("/")[1]
+    request["client_id"] = client_id
+
+    if rule_parent == "test":
+        return await handler(request)
+
+    if api.API_KEY and auth_key != api.API_KEY:
+        logger.error("You must send a valid auth key")
+        raise web.HTTPUnauthorized(text="you must send valid auth-key")
+
+    if not client_id and rule_parent != "admin":
+        raise web.HTTPBadRequest(text="client ID is mandatory")
+
+    if rule_parent != "admin":
+        client = await init_client(client_id)
+        request["client"] = client
+        request["driver"] = client.driver
+        request["driver_status"] = client.state.status
+
+        # If driver status is unkown, the page may have just changed, look again
+        if not client.state.is_alive():
+            client.driver.invalidate_status()
+            request["driver_status"] = await refresh_client_state(client)
+            logger.debug("Driver Status - " + request["driver_status"])
+
+    return await handler(request)
+
+
+def get_client_info(client_id):
+    """Get the status of a perticular client, as to he/she is connected or not
+
+    @param client_id: ID of client user
+    @return JSON object, see app.get_client_info
+    """
+    client = clients.get(client_id)
+    if client is None:
+        return None
+
+    return {
+        "is_alive": client.state.is_alive(),
+        "is_logged_in": client.state.status == WhatsAPIDriverStatus.LoggedIn,
+        "is_timer": client.is_listening,
+    }
+
+
+"""
+#####################
+##### API ROUTES ####
+#####################
+"""
+
+routes = web.RouteTableDef()
+
+
+# ---------------------------- Client -----------------------------------------
+
+
+@routes.put("/client")
+async def create_client(request):
+    """Create a new client driver. The driver is automatically created in
+    before_request middleware."""
+    return jsonify({"Success": request["client_id"] in clients})
+
+
+@routes.delete("/client")
+@browser_exclusive
+async def remove_client(request):
+    """Delete all objects related to client"""
+    preserve_cache = request.query.get("preserve_cache", False)
+    await delete_client(request["client_id"], preserve_cache)
+    return jsonify({"Success": True})
+
+
+# ---------------------------- WhatsApp ----------------------------------------
+
+
+@routes.get("/screen")
+async def get_screen(request):
+    """Capture chrome screen image and send it back. If the screen is currently
+    at qr scanning phase, return the image of qr only, else return image of full
+    screen"""
+    image_path = api.STATIC_FILES_PATH + "screen_" + request["client_id"] + ".png"
+    headers = {"Content-Type": "image/png"}
+    if request["driver_status"] != WhatsAPIDriverStatus.LoggedIn:
+        try:
+            await request["driver"].get_qr(image_path)
+            return web.FileResponse(image_path, headers=headers)
+        except Exception:
+            pass
+    await request["driver"].screenshot(image_path)
+    return web.FileResponse(image_path, headers=headers)
+
+
+@routes.get("/screen/qr")
+async def get_qr(request):
+    """Get qr as a json string"""
+    qr = await request["driver"].get_qr_plain()
+    return jsonify({"qr": qr})
+
+
+@routes.post("/screen/qr/request")
+async def initialise_authentication(request):
+    logger.info("QR requested")
+    request["client"].start_login_watcher()
+    return jsonify({
+        "success": True
+    })
+
+
+@routes.get("/screen/qr/base64")
+async def get_qr_base64(request):
+    """ Get qr as base64 string"""
+    logger.info("QR code in base64 requested")
+    driver = request["driver"]
+    try:
+        qr = await driver.get_qr_base64()
+        logger.info("Successfully returning QR code as base 64 string")
+        return jsonify({
+            "success": True,
+            "isLoggedIn": False,
+            "qr": qr
+        })
+    except NoSuchElementException:
+        phone = (await driver.get_id()).replace("\"", "").replace("@c.us", "")
+        logger.info("User is logged In, Successfully returning phone number")
+        return jsonify({
+            "success": True,
+            "msisdn": phone,
+            "isLoggedIn": True,
+            "qr": None
+        })
+
+
+@routes.get("/messages/unread")
+@login_required
+async def get_unread_messages(request):
+    """Get all unread messages"""
+    mark_seen = request.query.get("mark_seen", True)
+    driver = request["driver"]
+    unread_msg = await driver.get_unread(mark_seen=bool(mark_seen))
+
+    return jsonify(unread_msg)
+
+
+@routes.get("/contacts")
+@login_required
+async def get_contacts(request):
+    """Get contact list as json"""
+    return jsonify(await request["driver"].get_contacts())
+
+
+@routes.post("/open/receive/{appId}")
+async def receive_message(request):
+    appId = request.match_info["appId"]
+    form = await request.post()
+    logger.info("Twilio Message " + str(dict(form)) + " Received for Company " + str(appId))
+
+    try:
+        num_media = int(form.get("NumMedia", request.query.get("NumMedia")))
+    except (ValueError, TypeError):
+        return web.Response(text="Invalid request: invalid or missing NumMedia parameter", status=400)
+
+    # Reverse geocoding and queueing are blocking calls
+    reply = await run_in_executor(api.process_twilio_message, appId, dict(form), num_media)
+    if reply is not None:
+        return web.Response(text=reply, content_type="application/xml")
+    return web.Response(text="Received", content_type="application/json")
+
+
+# ------------------------------- Chats ---------------------------------------
+
+
+@routes.get("/chats")
+@login_required
+async def get_chats(request):
+    """Return all the chats"""
+    return jsonify(await request["driver"].get_all_chats_list())
+
+
+@routes.get("/chats/{chat_id}/messages")
+@login_required
+async def get_messages(request):
+    """Return all of the chat messages"""
+    chat_id = request.match_info["chat_id"]
+    mark_seen = request.query.get("mark_seen", True)
+    driver = request["driver"]
+
+    chat = await driver.get_chat_from_id(chat_id)
+    msgs = await driver.get_all_messages_in_chat(chat)
+
+    if mark_seen and msgs:
+        try:
+            await driver.chat_send_seen(chat_id)
+        except Exception:
+            pass
+
+    return jsonify(msgs)
+
+
+@routes.post("/chats/{chat_id}/messages")
+@login_required
+async def send_message(request):
+    """Queue a message to a chat on the send scheduler of app.py, see
+    app.send_message"""
+    chat = await request["driver"].get_chat_from_id(request.match_info["chat_id"])
+    job_id = api.schedule_chat_message(request["client_id"], chat, await request.json())
+
+    return jsonify({
+        'status': 'Message Received',
+        'jobId': job_id
+    })
+
+
+@routes.get("/jobs/{job_id}")
+async def get_send_job(request):
+    """Get the status of a message queued by POST /chats/{chat_id}/messages"""
+    job = api.send_scheduler.get_job(request.match_info["job_id"])
+    if not job or not job["chatKey"].startswith(request["client_id"] + ":"):
+        raise web.HTTPNotFound()
+    return jsonify(job)
+
+
+@routes.post("/blast/{chat_id}/messages")
+@login_required
+@browser_exclusive
+async def send_blast(request):
+    chat_id = request.match_info["chat_id"]
+    driver = request["driver"]
+    res = {
+        'status': 'Message Received'
+    }
+    data = await request.json()
+    message = data.get('message')
+    media_url = data.get('image')
+
+    if media_url is None:
+        await driver.send_message_to_id(chat_id, message)
+    else:
+        file_path = await run_in_executor(api.download_file, media_url)
+        await driver.send_media(file_path, chat_id, message)
+    return jsonify(res)
+
+
+@routes.get("/messages/{msg_id}/download")
+@login_required
+async def download_message_media(request):
+    """Download a media file, see app.download_message_media"""
+    msg_id = request.match_info["msg_id"]
+    key = request["client_id"] + ":" + msg_id
+    stored = api.received_media.get(key)
+    if stored:
+        return web.FileResponse(stored[0], headers={"Content-Type": stored[1]})
+
+    driver = request["driver"]
+    message = await driver.get_message_by_id(msg_id)
+
+    if not message or not message.mime:
+        raise web.HTTPNotFound()
+
+    chunks = driver.iter_media(message, True)
+    # Fetch the first chunk now, a failed download is still an error response
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        raise web.HTTPBadGateway(text="media download returned no data")
+
+    response = web.StreamResponse(headers={"Content-Type": message.mime})
+    await response.prepare(request)
+
+    file_name = api.received_media.get_file_name(key, message.mime)
+    tmp_path = api.received_media.get_temp_path(file_name)
+    try:
+        with open(tmp_path, "wb") as media_file:
+            media_file.write(first_chunk)
+            await response.write(first_chunk)
+            async for chunk in chunks:
+                media_file.write(chunk)
+                await response.write(chunk)
+        api.received_media.add_file(file_name, tmp_path)
+    except Exception:
+        logger.exception("Download of media " + key + " failed while streaming")
+        raise
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    await response.write_eof()
+    return response
+
+
+# --------------------------- Admin methods ----------------------------------
+
+
+@routes.get("/admin/clients")
+async def get_active_clients(request):
+    """Get a list of all active clients and their status"""
+    if not clients:
+        return jsonify([])
+
+    return jsonify({client_id: get_client_info(client_id) for client_id in clients})
+
+
+@routes.put("/admin/clients")
+async def run_clients(request):
+    """Force create driver for client """
+    form = await request.post()
+    client_ids = form.get("clients")
+    if not client_ids:
+        return jsonify({"Error": "no clients provided"})
+
+    result = {}
+    for client_id in client_ids.split(","):
+        await init_client(client_id)
+        result[client_id] = get_client_info(client_id)
+
+    return jsonify(result)
+
+
+@routes.delete("/admin/client")
+async def erase_client(request):
+    data = await request.json()
+    client_id = data.get("clients")[0]
+
+    if client_id in clients:
+        await delete_client(client_id, False)
+        return jsonify({"Success": True})
+    return jsonify({"Error": "Failed to delete profile"})
+
+
+@routes.delete("/admin/clients")
+async def kill_clients(request):
+    """Force kill driver and other objects for a perticular clien"""
+    client_ids = await request.json() if request.can_read_body else None
+    kill_dead = request.query.get("kill_dead", "true") in ["true", "1"]
+
+    if not kill_dead and not client_ids:
+        return jsonify({"Error": "no clients provided"})
+
+    for client_id in list(clients.keys()):
+        client = clients[client_id]
+        if kill_dead and client.state.status != WhatsAPIDriverStatus.LoggedIn or client_id in (client_ids or []):
+            logger.info("About to delete client")
+            await clients.pop(client_id).close()
+            logger.info("Deleted Driver Successfully")
+
+    return await get_active_clients(request)
+
+
+@routes.get("/admin/metrics")
+async def get_metrics(request):
+    """Get runtime metrics of the message processing pipeline"""
+    return jsonify({
+        "dispatcher": api.dispatcher.get_metrics(),
+        "outbound_queue": api.outbound_queue.get_metrics(),
+        "send_scheduler": api.send_scheduler.get_metrics(),
+        "media_cache": api.media_cache.get_metrics(),
+        "received_media": api.received_media.get_metrics(),
+        "driver_pool": api.driver_pool.get_metrics(),
+        "session_restore": api.restore_scheduler.get_progress(),
+        "conversation_state": api.conversation_state.get_metrics(),
+        "geocode_cache": api.geocode_cache.get_metrics(),
+        "randy": api.randy_client.get_metrics(),
+        "bot_routes": api.bot_router.get_metrics(),
+        "log_writer": api.log_writer.get_metrics(),
+    })
+
+
+@routes.get("/admin/routes")
+async def get_bot_routes(request):
+    """Bot routes in use and messages handled per route"""
+    return jsonify(api.bot_router.get_metrics())
+
+
+@routes.post("/admin/routes/reload")
+async def reload_bot_routes(request):
+    """Read the bot routes from the config file now"""
+    success = await run_in_executor(api.bot_router.reload)
+    return jsonify({"success": success, "version": api.bot_router.version,
+                    "error": api.bot_router.last_error})
+
+
+@routes.get("/admin/log_levels")
+async def get_log_levels(request):
+    """Level of the root logger and of the loggers set apart"""
+    return jsonify(api.log_writer.get_metrics())
+
+
+@routes.put("/admin/log_levels")
+async def set_log_levels(request):
+    """Change the level of loggers without a restart. Body: {"logger name": "DEBUG", ...},
+    null resets a logger to the level of its parent"""
+    try:
+        levels = await request.json()
+    except ValueError:
+        levels = None
+    if not isinstance(levels, dict):
+        return jsonify({"error": "body must be a JSON object of logger name -> level"}, 400)
+    try:
+        levels = api.log_writer.set_levels(levels)
+    except ValueError as e:
+        return jsonify({"error": str(e)}, 400)
+    return jsonify({"success": True, "levels": levels})
+
+
+@routes.get("/admin/restore")
+async def get_restore_progress(request):
+    """Progress of the session restore started with the server"""
+    return jsonify(api.restore_scheduler.get_progress())
+
+
+@routes.get("/admin/exception")
+async def get_last_exception(request):
+    """Get last exception"""
+    return jsonify([str(part) for part in sys.exc_info()])
+
+
+@routes.get("/")
+async def hello(request):
+    return web.Response(text="API is running")
+
+
+@routes.get("/test/ping")
+async def ping(request):
+    return web.Response(text="Application is running")
+
+
+"""
+#####################
+##### LIFECYCLE #####
+#####################
+"""
+
+
+async def on_startup(app):
+    # app.startup() is never called here, the threaded session restore and state monitor are not needed
+    api.start_services()
+    api.driver_pool.start()
+    app["restore"] = asyncio.ensure_future(restore_sessions(app))
+
+
+async def on_cleanup(app):
+    app["restore"].cancel()
+    for client_id in list(clients.keys()):
+        try:
+            await clients.pop(client_id).close()
+        except Exception:
+            logger.exception("Failed to quit driver of client " + client_id)
+    await asyncio.get_event_loop().run_in_executor(None, api.driver_pool.shutdown)
+    await asyncio.get_event_loop().run_in_executor(None, api.stop_services)
+
+
+def create_app():
+    app = web.Application(middlewares=[before_request])
+    app.add_routes(routes)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host=HOST, port=PORT)
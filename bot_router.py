@@ -0,0 +1,209 @@
+"""
+Routing of incoming messages to the bot handling them.
+
+Routes are read from the BOT_ROUTES setting of a config file (configs/<env>.cfg) and read again when
+the file changes, so a client is moved to another bot without a restart. A route is a client id, a
+client id and a chat id ("client:chat") or a client id and the first word of the message
+("client:#keyword"), the most specific route matching a message wins. Every route maps to a
+pipeline, the names of the handlers run one after another for the message.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("WhatsApp Backend")
+
+
+class RouteTable(object):
+    """
+    Routes of one version of the config, indexed for dict lookups
+    """
+
+    def __init__(self, routes, default, handlers):
+        """
+        @param self:
+        @param routes: dict route -> handler name or list of handler names
+        @param default: Pipeline of messages no route matches
+        @param handlers: Known handler names
+        """
+        self.default = self._pipeline(default, handlers)
+        self.clients = dict()
+        self.chats = dict()
+        self.keywords = dict()
+        for route, pipeline in routes.items():
+            pipeline = self._pipeline(pipeline, handlers)
+            client_id, _, rest = route.partition(":")
+            if not rest:
+                self.clients[client_id] = pipeline
+            elif rest.startswith("#"):
+                self.keywords[(client_id, rest[1:].lower())] = pipeline
+            else:
+                self.chats[(client_id, rest)] = pipeline
+
+    @staticmethod
+    def _pipeline(pipeline, handlers):
+        pipeline = (pipeline,) if isinstance(pipeline, str) else tuple(pipeline)
+        for name in pipeline:
+            if name not in handlers:
+                raise ValueError("Unknown bot handler " + repr(name))
+        return pipeline
+
+    def match(self, client_id, chat_id, keyword):
+        """
+        @param client_id: ID of client user
+        @param chat_id: ID of the chat
+        @param keyword: First word of the message, lower case
+        @return route name and pipeline
+        """
+        pipeline = self.chats.get((client_id, chat_id))
+        if pipeline is not None:
+            return client_id + ":" + chat_id, pipeline
+        if keyword and self.keywords:
+            pipeline = self.keywords.get((client_id, keyword))
+            if pipeline is not None:
+                return client_id + ":#" + keyword, pipeline
+        pipeline = self.clients.get(client_id)
+        if pipeline is not None:
+            return client_id, pipeline
+        return "default", self.default
+
+
+class BotRouter(object):
+    """
+    Hands every incoming message to the handlers of its route, counting messages per route
+    """
+
+    def __init__(self, path, handlers, default, reload_interval=10):
+        """
+        @param self:
+        @param path: Config file with the BOT_ROUTES and BOT_DEFAULT_ROUTE settings
+        @param handlers: dict handler name -> function called as handler(message_group, client_id)
+        @param default: Pipeline of messages no route matches, when the config has none
+        @param reload_interval: Min seconds between two checks of the config file for changes
+        """
+        self.path = path
+        self.handlers = handlers
+        self.default = default
+        self.reload_interval = reload_interval
+        self.version = 0
+        self.loaded_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0
+        self._table = RouteTable({}, default, handlers)
+        # route -> counters, see get_metrics
+        self._counters = collections.defaultdict(lambda: {"messages": 0, "failed": 0, "seconds": 0.0,
+                                                          "recent": collections.deque()})
+        self.reload()
+
+    def reload(self):
+        """Read the routes from the config file again, the current ones stay if it is invalid
+
+        @return boolean True if the routes were replaced
+        """
+        with self._lock:
+            self._checked = time.time()
+            try:
+                mtime = os.path.getmtime(self.path)
+                settings = dict()
+                with open(self.path) as config_file:
+                    exec(compile(config_file.read(), self.path, "exec"), settings)
+                table = RouteTable(settings.get("BOT_ROUTES", {}), settings.get("BOT_DEFAULT_ROUTE", self.default),
+                                   self.handlers)
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error("Bot routes of " + self.path + " not loaded: " + str(e))
+                return False
+            # Swapped in one assignment, dispatching threads never see half a table
+            self._table = table
+            self._mtime = mtime
+            self.version += 1
+            self.loaded_at = time.time()
+            self.last_error = None
+            logger.info("Bot routes version " + str(self.version) + " loaded from " + self.path)
+            return True
+
+    def _reload_if_changed(self):
+        now = time.time()
+        if now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+        try:
+            changed = os.path.getmtime(self.path) != self._mtime
+        except OSError:
+            changed = False
+        if changed:
+            self.reload()
+
+    def route(self, client_id, message_group):
+        """
+        @param client_id: ID of client user
+        @param message_group: MessageGroup received
+        @return route name and pipeline of the message
+        """
+        self._reload_if_changed()
+        table = self._table
+        keyword = None
+        if table.keywords:
+            content = message_group.messages[0].content
+            if isinstance(content, str) and content.strip():
+                keyword = content.split(None, 1)[0].lower()
+        return table.match(client_id, message_group.chat.id, keyword)
+
+    def dispatch(self, message_group, client_id):
+        """Run the pipeline of a message
+
+        @param message_group: MessageGroup received
+        @param client_id: ID of client user
+        """
+        route, pipeline = self.route(client_id, message_group)
+        started = time.time()
+        failed = False
+        try:
+            for name in pipeline:
+                self.handlers[name](message_group, client_id)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            now = time.time()
+            with self._lock:
+                counters = self._counters[route]
+                counters["messages"] += 1
+                counters["failed"] += failed
+                counters["seconds"] += now - started
+                recent = counters["recent"]
+                recent.append(now)
+                while recent and recent[0] < now - 60:
+                    recent.popleft()
+
+    def get_metrics(self):
+        """Routes and messages handled per route: total, failed, in the last minute and average seconds"""
+        table = self._table
+        now = time.time()
+        with self._lock:
+            routes = {}
+            for route, counters in self._counters.items():
+                routes[route] = {
+                    "messages": counters["messages"],
+                    "failed": counters["failed"],
+                    "last_minute": sum(1 for at in counters["recent"] if at >= now - 60),
+                    "average_seconds": counters["seconds"] / counters["messages"] if counters["messages"] else None,
+                }
+            return {
+                "path": self.path,
+                "version": self.version,
+                "loaded_at": self.loaded_at,
+                "last_error": self.last_error,
+                "table": {
+                    "default": list(table.default),
+                    "clients": {client_id: list(pipeline) for client_id, pipeline in table.clients.items()},
+                    "chats": {":".join(key): list(pipeline) for key, pipeline in table.chats.items()},
+                    "keywords": {key[0] + ":#" + key[1]: list(pipeline) for key, pipeline in table.keywords.items()},
+                },
+                "routes": routes,
+            }
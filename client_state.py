@@ -0,0 +1,95 @@
+"""
+Driver status of every client, probed in the background so requests never wait on a browser for it.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from webwhatsapi import WhatsAPIDriverStatus
+
+logger = logging.getLogger("WhatsApp Backend")
+
+
+class ClientState(object):
+    """
+    Last known driver status of a client. Kept up to date in the background by
+    ClientStateMonitor, so requests read it instead of probing the browser
+    """
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.status = WhatsAPIDriverStatus.Unknown
+        self.updated = 0
+        self.changed = 0
+
+    def is_alive(self):
+        return self.status in (WhatsAPIDriverStatus.NotLoggedIn, WhatsAPIDriverStatus.LoggedIn)
+
+    def update(self, status):
+        """ Records a probed status
+        @param self:
+        @param status: WhatsAPIDriverStatus of the driver
+        @return previous status
+        """
+        previous = self.status
+        now = time.time()
+        self.status = status
+        self.updated = now
+        if status != previous:
+            self.changed = now
+            logger.info("Client " + str(self.client_id) + " status changed " + previous + " -> " + status)
+        return previous
+
+
+class ClientStateMonitor(object):
+    """
+    Probes the driver status of every client at a fixed interval. Probes run
+    on a small pool of threads so a hanging browser only delays its own client
+    """
+
+    def __init__(self, interval, workers, get_client_ids, refresh):
+        """
+        @param self:
+        @param interval: Wait time between two probes of a client
+        @param workers: Number of probes running at the same time
+        @param get_client_ids: Function returning the IDs of the clients to probe
+        @param refresh: Function probing the status of a client id
+        """
+        self.interval = interval
+        self.get_client_ids = get_client_ids
+        self.refresh = refresh
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._started = False
+
+    def start(self):
+        """Start monitoring"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        monitor = threading.Thread(target=self._run, name="client-state-monitor")
+        monitor.daemon = True
+        monitor.start()
+
+    def _run(self):
+        while True:
+            for client_id in self.get_client_ids():
+                with self._lock:
+                    if client_id in self._pending:
+                        continue
+                    self._pending.add(client_id)
+                self._executor.submit(self._refresh, client_id)
+            time.sleep(self.interval)
+
+    def _refresh(self, client_id):
+        try:
+            self.refresh(client_id)
+        except Exception as e:
+            logger.error("Error refreshing status of client " + str(client_id) + ": " + str(e))
+        finally:
+            with self._lock:
+                self._pending.discard(client_id)
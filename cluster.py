@@ -0,0 +1,163 @@
+"""
+Registry of the nodes of a cluster and of the node owning each client.
+
+Every node runs app.py with its own chrome profiles. The registry is the one place saying which
+node serves a client, nodes forward requests of clients they do not own to the owner. Implement
+ClusterRegistry over another store (etcd, redis, a database server) to share it between hosts,
+SQLiteRegistry works for nodes sharing a disk and for tests.
+"""
+
+import sqlite3
+import threading
+import time
+
+
+class ClusterRegistry(object):
+    """
+    Interface of a registry. Nodes send heartbeats, nodes without a recent heartbeat are not
+    given new clients
+    """
+
+    def register_node(self, node_id, url):
+        """Add a node or update its URL, counts as a heartbeat
+
+        @param node_id: Unique name of the node
+        @param url: Base URL other nodes forward requests to
+        """
+        raise NotImplementedError
+
+    def heartbeat(self, node_id):
+        raise NotImplementedError
+
+    def get_nodes(self, max_age=None):
+        """Nodes and the number of clients they own
+
+        @param max_age: Seconds since the last heartbeat of a live node, None for all nodes
+        @return dict node id -> {"url", "heartbeat", "clients"}
+        """
+        raise NotImplementedError
+
+    def get_owner(self, client_id):
+        """
+        @param client_id: ID of client user
+        @return node id, None if no node owns the client
+        """
+        raise NotImplementedError
+
+    def claim(self, client_id, node_id):
+        """Make a node the owner of a client unless another node already is
+
+        @param client_id: ID of client user
+        @param node_id: Node asking for the client
+        @return node id of the owner after the claim
+        """
+        raise NotImplementedError
+
+    def assign(self, client_id, node_id):
+        """Make a node the owner of a client, whichever node owned it before"""
+        raise NotImplementedError
+
+    def release(self, client_id):
+        """Remove the owner of a client"""
+        raise NotImplementedError
+
+    def get_clients(self, node_id):
+        """
+        @param node_id: Node id
+        @return list of client ids owned by the node
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the connection to the store"""
+
+    def place(self, client_id, node_id, max_age):
+        """Claim a new client for the live node owning the fewest clients
+
+        @param client_id: ID of client user
+        @param node_id: Node asking, used when no node is live
+        @param max_age: Seconds since the last heartbeat of a live node
+        @return node id of the owner
+        """
+        owner = self.get_owner(client_id)
+        if owner is not None:
+            return owner
+        nodes = self.get_nodes(max_age)
+        target = min(nodes, key=lambda node: (nodes[node]["clients"], node)) if nodes else node_id
+        return self.claim(client_id, target)
+
+
+class SQLiteRegistry(ClusterRegistry):
+    """
+    Registry kept in a SQLite file, for nodes sharing a disk
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS nodes (
+            node_id TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            heartbeat REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS owners (
+            client_id TEXT PRIMARY KEY,
+            node_id TEXT NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS owners_node ON owners (node_id);
+    """
+
+    def __init__(self, path):
+        """
+        @param path: SQLite file of the registry
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        # The file is shared with other processes, each statement is its own transaction
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(self._SCHEMA)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def register_node(self, node_id, url):
+        self._execute(
+            "INSERT INTO nodes (node_id, url, heartbeat) VALUES (?, ?, ?) "
+            "ON CONFLICT (node_id) DO UPDATE SET url = excluded.url, heartbeat = excluded.heartbeat",
+            (node_id, url, time.time()))
+
+    def heartbeat(self, node_id):
+        self._execute("UPDATE nodes SET heartbeat = ? WHERE node_id = ?", (time.time(), node_id))
+
+    def get_nodes(self, max_age=None):
+        rows = self._execute(
+            "SELECT nodes.node_id, url, heartbeat, COUNT(owners.client_id) FROM nodes "
+            "LEFT JOIN owners ON owners.node_id = nodes.node_id "
+            "WHERE heartbeat >= ? GROUP BY nodes.node_id",
+            (time.time() - max_age if max_age is not None else 0,))
+        return {node_id: {"url": url, "heartbeat": heartbeat, "clients": clients}
+                for node_id, url, heartbeat, clients in rows}
+
+    def get_owner(self, client_id):
+        rows = self._execute("SELECT node_id FROM owners WHERE client_id = ?", (client_id,))
+        return rows[0][0] if rows else None
+
+    def claim(self, client_id, node_id):
+        self._execute("INSERT OR IGNORE INTO owners (client_id, node_id, updated) VALUES (?, ?, ?)",
+                      (client_id, node_id, time.time()))
+        return self.get_owner(client_id)
+
+    def assign(self, client_id, node_id):
+        self._execute("INSERT OR REPLACE INTO owners (client_id, node_id, updated) VALUES (?, ?, ?)",
+                      (client_id, node_id, time.time()))
+
+    def release(self, client_id):
+        self._execute("DELETE FROM owners WHERE client_id = ?", (client_id,))
+
+    def get_clients(self, node_id):
+        return [row[0] for row in self._execute("SELECT client_id FROM owners WHERE node_id = ?", (node_id,))]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
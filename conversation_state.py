@@ -0,0 +1,153 @@
+"""
+Quick reply menus last sent to each chat.
+
+A menu maps the number and the title of every option to its payload, so the reply of a user can be
+turned back into the payload of the option chosen. Menus expire after a TTL, the least recently
+used ones are dropped past a size cap, and with a path they are kept in SQLite and survive restarts.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class QuickReplyMenu(object):
+    """
+    Options of a menu, by number ("1", "2", ...) and by title, lower case without spaces
+    """
+
+    def __init__(self, numbers=None, titles=None, expires=None):
+        self.numbers = numbers or dict()
+        self.titles = titles or dict()
+        self.expires = expires
+
+
+class ConversationStateStore(object):
+    """
+    Size bounded LRU store of the quick reply menu of each chat, with a TTL per chat and optional
+    persistence. Safe to share between threads
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS menus (
+            chat_id TEXT PRIMARY KEY,
+            numbers TEXT NOT NULL,
+            titles TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS menus_expires ON menus (expires);
+    """
+
+    # Expired rows are deleted from the file every this many writes
+    _PURGE_EVERY = 1000
+
+    def __init__(self, max_chats, ttl, path=None):
+        """
+        @param self:
+        @param max_chats: Max menus kept in memory, least recently used ones are dropped first
+        @param ttl: Seconds a menu stays valid after it was sent
+        @param path: SQLite file keeping the menus across restarts, None to keep them in memory only
+        """
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        # chat id -> QuickReplyMenu, least recently used first
+        self._menus = OrderedDict()
+        self._writes = 0
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(self._SCHEMA)
+
+    def set_menu(self, chat_id, numbers, titles):
+        """Replace the menu of a chat
+
+        @param chat_id: ID of the chat
+        @param numbers: dict option number -> payload
+        @param titles: dict option title, lower case without spaces -> payload
+        """
+        menu = QuickReplyMenu(dict(numbers), dict(titles), time.time() + self.ttl)
+        with self._lock:
+            self._menus[chat_id] = menu
+            self._menus.move_to_end(chat_id)
+            while len(self._menus) > self.max_chats:
+                self._menus.popitem(last=False)
+                self.evictions += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO menus (chat_id, numbers, titles, expires) VALUES (?, ?, ?, ?)",
+                    (chat_id, json.dumps(menu.numbers), json.dumps(menu.titles), menu.expires))
+                self._writes += 1
+                if self._writes % self._PURGE_EVERY == 0:
+                    self._db.execute("DELETE FROM menus WHERE expires < ?", (time.time(),))
+
+    def get_menu(self, chat_id):
+        """Menu of a chat, empty if none was sent or it expired
+
+        @param chat_id: ID of the chat
+        @return QuickReplyMenu
+        """
+        now = time.time()
+        with self._lock:
+            menu = self._menus.get(chat_id)
+            if menu is None and self._db is not None:
+                # Dropped from memory or sent before a restart
+                row = self._db.execute("SELECT numbers, titles, expires FROM menus WHERE chat_id = ?",
+                                       (chat_id,)).fetchone()
+                if row is not None:
+                    menu = QuickReplyMenu(json.loads(row[0]), json.loads(row[1]), row[2])
+                    self._menus[chat_id] = menu
+                    while len(self._menus) > self.max_chats:
+                        self._menus.popitem(last=False)
+                        self.evictions += 1
+
+            if menu is not None and menu.expires < now:
+                self._delete(chat_id)
+                self.expirations += 1
+                menu = None
+
+            if menu is None:
+                self.misses += 1
+                return QuickReplyMenu()
+            self._menus.move_to_end(chat_id)
+            self.hits += 1
+            return menu
+
+    def delete_menu(self, chat_id):
+        """Forget the menu of a chat
+
+        @param chat_id: ID of the chat
+        """
+        with self._lock:
+            self._delete(chat_id)
+
+    def _delete(self, chat_id):
+        self._menus.pop(chat_id, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM menus WHERE chat_id = ?", (chat_id,))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get_metrics(self):
+        with self._lock:
+            return {
+                "chats": len(self._menus),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "persistent": self._db is not None,
+            }
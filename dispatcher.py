@@ -0,0 +1,115 @@
+"""
+Worker pool processing incoming messages, in order within every chat.
+"""
+
+import logging
+import queue
+import threading
+import zlib
+
+logger = logging.getLogger("WhatsApp Backend")
+
+
+class MessageDispatcher(object):
+    """
+    Fixed pool of worker threads processing incoming messages. Every chat is
+    pinned to one worker, so messages of a conversation are handled in the
+    order they were received
+    """
+
+    def __init__(self, workers, queue_size, put_timeout=None):
+        """ Starts the workers
+        @param self:
+        @param workers: Number of worker threads
+        @param queue_size: Max number of waiting messages per worker
+        @param put_timeout: Max seconds submit blocks while a worker queue is full, None waits forever
+        """
+        self.put_timeout = put_timeout
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._busy = 0
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._workers = []
+        for index, worker_queue in enumerate(self._queues):
+            worker = threading.Thread(target=self._work, args=(worker_queue,), name="dispatcher-" + str(index))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _shard(self, key):
+        return zlib.crc32(key.encode("utf-8")) % len(self._queues)
+
+    def submit(self, key, function, *args):
+        """Queue a call on the worker owning key. Blocks while that worker is
+        full, which holds back the caller fetching new messages
+
+        @param key: Ordering key, calls with the same key run one after another
+        @param function: Function object that is needed to be called
+        @param *args: args to pass to the called function
+        @return boolean True if queued, False if rejected after put_timeout or once stopped
+        """
+        if self._stopped:
+            logger.error("Dispatcher stopped, dropping message for " + key)
+            return False
+        try:
+            self._queues[self._shard(key)].put((function, args), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            logger.error("Dispatcher queue full, dropping message for " + key)
+            return False
+
+    def stop(self, timeout=None):
+        """Process the calls already queued, then stop the workers
+
+        @param timeout: Max seconds to wait for each worker, None waits until it is done
+        """
+        self._stopped = True
+        for worker_queue in self._queues:
+            try:
+                worker_queue.put((None, None), timeout=timeout)
+            except queue.Full:
+                logger.error("Dispatcher worker still busy on shutdown, " + str(worker_queue.qsize()) +
+                             " messages not processed")
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _work(self, worker_queue):
+        while True:
+            function, args = worker_queue.get()
+            if function is None:
+                worker_queue.task_done()
+                return
+            with self._lock:
+                self._busy += 1
+            try:
+                function(*args)
+                with self._lock:
+                    self.processed += 1
+            except Exception:
+                logger.exception("Error processing message")
+                with self._lock:
+                    self.failed += 1
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                worker_queue.task_done()
+
+    def get_metrics(self):
+        """Queue depth and worker utilisation of the pool"""
+        depths = [worker_queue.qsize() for worker_queue in self._queues]
+        with self._lock:
+            return {
+                "workers": len(self._queues),
+                "busy_workers": self._busy,
+                "utilisation": self._busy / len(self._queues),
+                "queue_depth": sum(depths),
+                "queue_depths": depths,
+                "processed": self.processed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
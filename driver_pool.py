@@ -0,0 +1,133 @@
+"""
+Standby Chrome instances, launched ahead of the clients taking them over.
+"""
+
+import collections
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger("WhatsApp Backend")
+
+
+class DriverPool(object):
+    """
+    Chrome instances launched and navigated to WhatsApp Web ahead of need. A new
+    client takes one over and only loads its saved session into it, instead of
+    waiting for a browser to start
+    """
+
+    def __init__(self, size, launch, retry_interval=30):
+        """
+        @param self:
+        @param size: Number of standby drivers to keep ready, 0 disables the pool
+        @param launch: Function returning a new standby driver
+        @param retry_interval: Seconds to wait after a failed launch
+        """
+        self.size = size
+        self.retry_interval = retry_interval
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self._launch = launch
+        self._standby = queue.Queue()
+        self._lock = threading.Lock()
+        # Seconds spent launching standby drivers, and getting a driver to a client
+        self._launch_times = collections.deque(maxlen=100)
+        self._assign_times = {"warm": collections.deque(maxlen=100), "cold": collections.deque(maxlen=100)}
+        self._wakeup = threading.Event()
+        self._running = False
+
+    def start(self):
+        """Start filling the pool in the background"""
+        if self.size <= 0 or self._running:
+            return
+        self._running = True
+        thread = threading.Thread(target=self._fill, name="driver-pool")
+        thread.daemon = True
+        thread.start()
+
+    def _fill(self):
+        while self._running:
+            if self._standby.qsize() >= self.size:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            started = time.time()
+            try:
+                driver = self._launch()
+            except Exception:
+                logger.exception("Failed to launch a standby driver")
+                with self._lock:
+                    self.failures += 1
+                time.sleep(self.retry_interval)
+                continue
+            with self._lock:
+                self._launch_times.append(time.time() - started)
+                # A launch finishing after shutdown would have nobody left to quit it
+                if self._running:
+                    self._standby.put(driver)
+                    continue
+            try:
+                driver.quit()
+            except Exception:
+                logger.exception("Failed to quit a standby driver")
+
+    def acquire(self):
+        """Take a standby driver out of the pool, a new one is launched in its place
+
+        @return standby driver, None if the pool is empty
+        """
+        try:
+            driver = self._standby.get_nowait()
+        except queue.Empty:
+            driver = None
+        with self._lock:
+            if driver is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self._wakeup.set()
+        return driver
+
+    def record_assign(self, seconds, warm):
+        """Record how long a client waited for its driver
+
+        @param seconds: Time from request to ready driver
+        @param warm: True if the driver came from the pool
+        """
+        with self._lock:
+            self._assign_times["warm" if warm else "cold"].append(seconds)
+
+    def shutdown(self):
+        """Stop refilling and quit the standby drivers"""
+        with self._lock:
+            self._running = False
+        self._wakeup.set()
+        while True:
+            try:
+                self._standby.get_nowait().quit()
+            except queue.Empty:
+                return
+            except Exception:
+                logger.exception("Failed to quit a standby driver")
+
+    def get_metrics(self):
+        """Hit rate of the pool and launch latencies"""
+        def average(times):
+            return sum(times) / len(times) if times else None
+
+        with self._lock:
+            requests_count = self.hits + self.misses
+            return {
+                "size": self.size,
+                "standby": self._standby.qsize(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests_count if requests_count else None,
+                "launch_failures": self.failures,
+                "launch_seconds": average(self._launch_times),
+                "warm_assign_seconds": average(self._assign_times["warm"]),
+                "cold_assign_seconds": average(self._assign_times["cold"]),
+            }
@@ -0,0 +1,180 @@
+"""
+Cache of reverse geocoding results for location messages.
+
+Coordinates are rounded to a grid, every pin within the same cell maps to the same place, so a
+customer sending the same delivery pin again costs neither an API call nor its latency. Entries
+expire after a TTL, the least recently used ones are dropped past a size cap, and with a path they
+are kept in SQLite and survive restarts.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+
+class StubGeocoder(object):
+    """
+    Offline stand-in for googlemaps.Client, answers every lookup with a made up place after an
+    optional delay. For benchmarks and tests
+    """
+
+    def __init__(self, delay=0):
+        """
+        @param self:
+        @param delay: Seconds every lookup takes, like the latency of the real API
+        """
+        self.delay = delay
+        self.calls = 0
+
+    def reverse_geocode(self, latlng):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        lat, lng = float(latlng[0]), float(latlng[1])
+        place_id = "stub-{0:08x}".format(zlib.crc32("{0:.5f},{1:.5f}".format(lat, lng).encode("utf-8")))
+        return [{"place_id": place_id, "formatted_address": "{0:.5f}, {1:.5f}".format(lat, lng)}]
+
+
+class GeocodeCache(object):
+    """
+    Size bounded LRU cache of reverse geocoding results by grid cell, with a TTL and optional
+    persistence. Safe to share between threads
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS places (
+            cell TEXT PRIMARY KEY,
+            place TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS places_expires ON places (expires);
+    """
+
+    # Expired rows are deleted from the file every this many writes
+    _PURGE_EVERY = 1000
+
+    def __init__(self, geocoder, precision, ttl, max_entries, path=None):
+        """
+        @param self:
+        @param geocoder: Function returning the geocoder, an object with googlemaps' reverse_geocode((lat, lng))
+        @param precision: Decimals the coordinates are rounded to, 4 makes cells of about 11 meters
+        @param ttl: Seconds a place is kept
+        @param max_entries: Max places kept in memory, least recently used ones are dropped first
+        @param path: SQLite file keeping the places across restarts, None to keep them in memory only
+        """
+        self.get_geocoder = geocoder
+        self.precision = precision
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lookup_times = deque(maxlen=100)
+        self._lock = threading.Lock()
+        # cell -> (place, expires), least recently used first
+        self._places = OrderedDict()
+        self._writes = 0
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(self._SCHEMA)
+
+    def get_cell(self, lat, lng):
+        """
+        @param lat: Latitude, number or string
+        @param lng: Longitude, number or string
+        @return string key of the grid cell holding the point
+        """
+        return "{0:.{2}f},{1:.{2}f}".format(float(lat), float(lng), self.precision)
+
+    def reverse_geocode(self, lat, lng):
+        """Place at a point, looked up only if its grid cell is not cached
+
+        @param lat: Latitude, number or string
+        @param lng: Longitude, number or string
+        @return dict with place_id and formatted_address, None if the geocoder knows no place there
+        """
+        cell = self.get_cell(lat, lng)
+        found, place = self._get(cell)
+        if found:
+            return place
+
+        started = time.time()
+        # The point of the first message in a cell is looked up, every later one gets its result
+        results = self.get_geocoder().reverse_geocode((float(lat), float(lng)))
+        place = None
+        if results:
+            place = {"place_id": results[0]["place_id"], "formatted_address": results[0]["formatted_address"]}
+        self._put(cell, place, time.time() - started)
+        return place
+
+    def get_cached(self, lat, lng):
+        """Place at a point if its grid cell is cached, never calls the geocoder
+
+        @param lat: Latitude, number or string
+        @param lng: Longitude, number or string
+        @return dict with place_id and formatted_address, None if not cached
+        """
+        return self._get(self.get_cell(lat, lng), False)[1]
+
+    def _get(self, cell, count=True):
+        now = time.time()
+        with self._lock:
+            entry = self._places.get(cell)
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT place, expires FROM places WHERE cell = ?", (cell,)).fetchone()
+                if row is not None:
+                    entry = (json.loads(row[0]), row[1])
+                    self._insert(cell, entry)
+            if entry is None or entry[1] < now:
+                if count:
+                    self.misses += 1
+                return False, None
+            self._places.move_to_end(cell)
+            if count:
+                self.hits += 1
+            return True, entry[0]
+
+    def _put(self, cell, place, lookup_seconds):
+        entry = (place, time.time() + self.ttl)
+        with self._lock:
+            self._lookup_times.append(lookup_seconds)
+            self._insert(cell, entry)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO places (cell, place, expires) VALUES (?, ?, ?)",
+                                 (cell, json.dumps(place), entry[1]))
+                self._writes += 1
+                if self._writes % self._PURGE_EVERY == 0:
+                    self._db.execute("DELETE FROM places WHERE expires < ?", (time.time(),))
+
+    def _insert(self, cell, entry):
+        self._places[cell] = entry
+        self._places.move_to_end(cell)
+        while len(self._places) > self.max_entries:
+            self._places.popitem(last=False)
+            self.evictions += 1
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get_metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._places),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "lookup_seconds": sum(self._lookup_times) / len(self._lookup_times) if self._lookup_times else None,
+                "persistent": self._db is not None,
+            }
@@ -0,0 +1,45 @@
+"""
+Consistent hashing of client ids to shards, shared by router.py and the app.py workers
+"""
+
+import bisect
+import hashlib
+
+
+class HashRing(object):
+    """
+    Consistent hash ring mapping client ids to shard names. Every shard is
+    placed on the ring many times, a client belongs to the first shard
+    point after its own hash. Adding a shard only takes clients over from
+    the others, no client moves between two existing shards
+    """
+
+    def __init__(self, nodes, replicas=160):
+        """
+        @param self:
+        @param nodes: Shard names
+        @param replicas: Points per shard on the ring, more points spread clients more evenly
+        """
+        self.nodes = list(nodes)
+        self.replicas = replicas
+        ring = sorted(
+            (self._hash(node + "#" + str(replica)), node) for node in self.nodes for replica in range(replicas)
+        )
+        self._keys = [key for key, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    @staticmethod
+    def _hash(key):
+        # Same value in every process, unlike hash()
+        return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+    def get_node(self, key):
+        """Shard owning a key
+
+        @param key: client id
+        @return shard name, None if the ring is empty
+        """
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._owners[index]
@@ -0,0 +1,82 @@
+"""
+Shared client for outbound HTTP calls: webhooks, bots and media downloads.
+"""
+
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpClient(object):
+    """
+    Shared client for all outbound HTTP calls. Connections are kept alive in a
+    pool per host and the number of requests in flight is bounded
+    """
+
+    def __init__(self, pool_connections, pool_maxsize, max_concurrency, timeout):
+        """ Creates the session and its connection pools
+        @param self:
+        @param pool_connections: Number of hosts to keep a connection pool for
+        @param pool_maxsize: Max connections kept alive per host
+        @param max_concurrency: Max requests in flight over all hosts
+        @param timeout: Default (connect, read) timeout in seconds
+        """
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def request(self, method, url, **kwargs):
+        """Sends a request over the pooled session, waits for a free slot first.
+        A streamed response keeps its slot while its body is read, it must be closed to give the slot
+        and its connection back"""
+        kwargs.setdefault("timeout", self.timeout)
+        self._slots.acquire()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        if not kwargs.get("stream"):
+            self._slots.release()
+            return response
+
+        release = _ReleaseOnce(self._slots)
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                release()
+
+        response.close = close_and_release
+        # A streamed response dropped without being closed still gives its slot back
+        weakref.finalize(response, release)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+class _ReleaseOnce(object):
+    """Releases a semaphore on the first call only, a response may be closed more than once"""
+
+    def __init__(self, semaphore):
+        self._semaphore = semaphore
+        self._lock = threading.Lock()
+        self._released = False
+
+    def __call__(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._semaphore.release()
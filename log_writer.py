@@ -0,0 +1,218 @@
+"""
+Logging written from a background thread.
+
+Loggers only put their records on a queue, one thread takes them off and writes them as JSON lines,
+an object per record, to a file rotated when it grows past a size and at a time interval. Threads
+logging never wait on the disk, when the queue is full records are dropped and counted. Levels are
+set per logger name, so a chatty module can be kept quiet while the rest logs INFO.
+"""
+
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+PLAIN_FORMAT = "%(asctime)s  %(levelname)s : %(message)s"
+
+
+def parse_levels(text):
+    """Levels per logger from a setting like "webwhatsapi=DEBUG,werkzeug=WARNING"
+
+    @param text: Comma separated name=level pairs, may be empty
+    @return dict logger name -> level name
+    """
+    levels = dict()
+    for pair in (text or "").split(","):
+        name, _, level = pair.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    One compact JSON object per record: time, level, logger, thread, message and traceback if any
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+
+class SizedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """
+    File rotated at a time interval like TimedRotatingFileHandler, and also as soon as it would grow
+    past max_bytes
+    """
+
+    def __init__(self, path, max_bytes, when="midnight", backup_count=7):
+        """
+        @param self:
+        @param path: Log file
+        @param max_bytes: Size the file is rotated at, 0 to rotate on time only
+        @param when: Interval of the time rotation, see TimedRotatingFileHandler
+        @param backup_count: Rotated files kept, the oldest are deleted
+        """
+        TimedRotatingFileHandler.__init__(self, path, when=when, backupCount=backup_count, encoding="utf-8",
+                                          delay=True)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record):
+        if TimedRotatingFileHandler.shouldRollover(self, record):
+            return True
+        if not self.max_bytes:
+            return False
+        if self.stream is None:
+            self.stream = self._open()
+        size = self.stream.tell()
+        # A file holding nothing yet is never rotated, even for a record bigger than max_bytes
+        return size > 0 and size + len(self.format(record)) + 1 > self.max_bytes
+
+    def rotation_filename(self, default_name):
+        # Files rotated for size within one interval get the same time suffix, number them instead
+        # of replacing the earlier one
+        name = default_name
+        index = 1
+        while os.path.exists(name):
+            name = default_name + "." + str(index)
+            index += 1
+        return name
+
+
+class _DroppingQueueHandler(QueueHandler):
+
+    def __init__(self, log_writer):
+        QueueHandler.__init__(self, log_writer.queue)
+        self.log_writer = log_writer
+        self._traceback_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # The writer thread gets the message and traceback as text, the arguments of the record
+        # may have changed or be gone by the time it is written
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.log_writer.count_dropped()
+
+
+class LogWriter(object):
+    """
+    Takes the records of all loggers through a queue and writes them from one thread, to a JSON lines
+    file rotated on size and time, and to the console
+    """
+
+    def __init__(self, path, level="INFO", levels=None, max_bytes=50 * 1024 * 1024, when="midnight",
+                 backup_count=7, console=True, max_queue=100000):
+        """
+        @param self:
+        @param path: Log file
+        @param level: Level of the loggers without one in levels
+        @param levels: dict logger name -> level, for that logger and the ones below it
+        @param max_bytes: Size the file is rotated at, 0 to rotate on time only
+        @param when: Interval of the time rotation, see TimedRotatingFileHandler
+        @param backup_count: Rotated files kept
+        @param console: Also write the records to stderr, in the plain format
+        @param max_queue: Records waiting to be written past which new ones are dropped
+        """
+        self.path = path
+        self.level = level
+        self.levels = dict()
+        self.dropped = 0
+        self.started = False
+        self._lock = threading.Lock()
+        self.queue = queue.Queue(max_queue)
+        self.handler = _DroppingQueueHandler(self)
+
+        file_handler = SizedTimedRotatingFileHandler(path, max_bytes, when, backup_count)
+        file_handler.setFormatter(JsonLinesFormatter())
+        handlers = [file_handler]
+        if console:
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(logging.Formatter(PLAIN_FORMAT))
+            handlers.append(console_handler)
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self._initial_levels = levels or dict()
+
+    def start(self):
+        """Send the records of all loggers to the queue and start writing them"""
+        with self._lock:
+            if self.started:
+                return
+            self.started = True
+        root = logging.getLogger()
+        root.setLevel(self.level)
+        root.addHandler(self.handler)
+        self.set_levels(self._initial_levels)
+        self.listener.start()
+
+    def stop(self):
+        """Write the records still queued and stop the thread, later records are dropped"""
+        with self._lock:
+            if not self.started:
+                return
+            self.started = False
+        logging.getLogger().removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+
+    def set_levels(self, levels):
+        """Change the level of some loggers, records below it are dropped before they are queued
+
+        @param levels: dict logger name -> level name or number, None resets a logger to its parent's
+        @return dict of the levels set by name
+        """
+        numbers = dict()
+        for name, level in levels.items():
+            if isinstance(level, str):
+                level = logging.getLevelName(level.upper())
+            if level is not None and not isinstance(level, int):
+                raise ValueError("Unknown level " + repr(levels[name]) + " for logger " + repr(name))
+            numbers[name] = level
+
+        for name, level in numbers.items():
+            logger = logging.getLogger(name)
+            if level is None:
+                logger.setLevel(logging.NOTSET)
+                self.levels.pop(name, None)
+            else:
+                logger.setLevel(level)
+                self.levels[name] = logging.getLevelName(level)
+        return dict(self.levels)
+
+    def count_dropped(self):
+        with self._lock:
+            self.dropped += 1
+
+    def get_metrics(self):
+        return {
+            "path": self.path,
+            "level": logging.getLevelName(logging.getLogger().level),
+            "levels": dict(self.levels),
+            "queued": self.queue.qsize(),
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,105 @@
+"""
+Push delivery of incoming messages.
+
+A listener thread per client picks new messages up from the buffer of the page and hands every
+batch to a function, instead of scanning all chats for unread messages on a timer. Every wait inside
+the browser is short and followed by a pause outside of it, so sends, status probes and media
+downloads of the client never queue long behind the listener.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger("WhatsApp Backend")
+
+
+class MessageListener(object):
+    """
+    Waits inside the browser of a client for new messages and hands every
+    batch to the given function. Same start/stop interface as RepeatedTimer
+    so both can be kept in the timers dict
+    """
+
+    def __init__(self, client_id, get_driver, function, wait_timeout, poll_interval, idle_interval=2):
+        """ Starts listening for new messages
+        @param self:
+        @param client_id: ID of client user
+        @param get_driver: Function returning the current driver of the client, None if it has none
+        @param function: Function object called with (client_id, message_groups, mark_seen)
+        @param wait_timeout: Max seconds a single wait may block the browser
+        @param poll_interval: Seconds between two waits, the browser is free for other calls meanwhile
+        @param idle_interval: Wait time between retries while not logged in
+        """
+        self._thread = None
+        self.client_id = client_id
+        self.get_driver = get_driver
+        self.function = function
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.idle_interval = idle_interval
+        self.is_running = False
+        self.start()
+
+    def _run(self):
+        logged_in = False
+        # Messages handed over by the sweep, the buffer of the page may hold some of them too
+        swept = set()
+        # A restarted listener replaces the thread, the old one leaves after its current wait
+        while self._thread is threading.current_thread():
+            driver = self.get_driver()
+            try:
+                if not logged_in and driver and driver.is_logged_in():
+                    logged_in = True
+                    swept = self._sweep(driver)
+                if logged_in:
+                    message_groups = self.drop_swept(driver.get_new_message_groups(self.wait_timeout), swept)
+                    if message_groups:
+                        self.function(self.client_id, message_groups, True)
+                        continue
+                    time.sleep(self.poll_interval)
+                    continue
+            except Exception as e:
+                logger.error("Waiting for new messages failed for client " + str(self.client_id) + ": " + str(e))
+                logged_in = False
+            time.sleep(self.idle_interval)
+
+    def _sweep(self, driver):
+        """Hand over the messages left unread before the page loaded, the buffer only gets the ones
+        arriving after it
+
+        @return set of the IDs of the messages handed over
+        """
+        message_groups = driver.get_unread(mark_seen=True)
+        if message_groups:
+            self.function(self.client_id, message_groups, False)
+        return set(message.id for message_group in message_groups for message in message_group.messages)
+
+    @staticmethod
+    def drop_swept(message_groups, swept):
+        """
+        @param message_groups: list of MessageGroup taken from the buffer of the page
+        @param swept: IDs of the messages already handed over by the sweep
+        @return list of MessageGroup without those messages
+        """
+        if not swept:
+            return message_groups
+        kept = []
+        for message_group in message_groups:
+            message_group.messages = [message for message in message_group.messages if message.id not in swept]
+            if message_group.messages:
+                kept.append(message_group)
+        return kept
+
+    def start(self):
+        """Creates a listening thread and start it"""
+
+        if not self.is_running:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            self.is_running = True
+
+    def stop(self):
+        """Stop listening"""
+        self._thread = None
+        self.is_running = False
@@ -0,0 +1,342 @@
+"""
+Disk backed queue of the webhook calls forwarding incoming messages.
+
+Calls are stored in SQLite before they are sent, delivered by a pool of threads and retried with
+exponential backoff, so a slow or down backend neither blocks message processing nor loses messages.
+"""
+
+import collections
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("WhatsApp Backend")
+
+
+class OutboundQueue(object):
+    """
+    Disk backed queue of outgoing webhook calls. Calls are stored in SQLite
+    before delivery and retried with exponential backoff, so a slow or down
+    backend neither blocks message processing nor loses messages, even
+    across restarts. Delivery is idempotent on the message id and ordered
+    per chat. Several processes may share the file: every message in flight
+    is leased to the process sending it, only messages whose lease ran out
+    are taken over by another process
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbound (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id TEXT NOT NULL UNIQUE,
+            chat_key TEXT NOT NULL,
+            url TEXT NOT NULL,
+            headers TEXT NOT NULL,
+            body TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL,
+            created REAL NOT NULL,
+            last_error TEXT,
+            owner TEXT,
+            lease REAL
+        );
+        CREATE INDEX IF NOT EXISTS outbound_due ON outbound (state, next_attempt);
+        CREATE INDEX IF NOT EXISTS outbound_chat ON outbound (chat_key, state);
+    """
+
+    # Columns added after the first version of the table, added to older files when opened
+    _ADDED_COLUMNS = (("owner", "TEXT"), ("lease", "REAL"))
+
+    def __init__(self, path, post, workers, max_attempts, backoff_base, backoff_max,
+                 batch_size=1, batch_url=None, retention=86400, lease=120):
+        """ Opens the queue, start() starts delivering
+        @param self:
+        @param path: SQLite file holding the queue
+        @param post: Function object sending a request, called as post(url, headers=, data=)
+        @param workers: Number of deliveries in flight
+        @param max_attempts: Attempts before a message is marked as failed
+        @param backoff_base: Seconds to wait before the first retry, doubled on every retry
+        @param backoff_max: Max seconds to wait between retries
+        @param batch_size: Max messages per POST, more than 1 needs batch_url
+        @param batch_url: Endpoint accepting a JSON list of messages
+        @param retention: Seconds a delivered message id is kept to ignore duplicates
+        @param lease: Seconds a message in flight stays claimed without being renewed, past it another
+        process takes the message over
+        """
+        self.path = path
+        self.post = post
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.batch_size = batch_size if batch_url else 1
+        self.batch_url = batch_url
+        self.retention = retention
+        self.lease = lease
+        # Unique per queue instance, two processes or two queues in one process never share it
+        self.owner = "{0}:{1}:{2}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.retries = 0
+        self.duplicates = 0
+        self._sent_times = collections.deque()
+        self._last_prune = 0
+        self._last_renew = 0
+        self._running = False
+        self._drainer = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._slots = threading.BoundedSemaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+        # Other processes may hold the write lock for a moment, wait for it instead of failing
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(self._SCHEMA)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(outbound)")]
+        for name, column_type in self._ADDED_COLUMNS:
+            if name not in columns:
+                self._db.execute("ALTER TABLE outbound ADD COLUMN " + name + " " + column_type)
+
+    def start(self):
+        """Start delivering in the background"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._drainer = threading.Thread(target=self._drain, name="outbound-queue")
+        self._drainer.daemon = True
+        self._drainer.start()
+
+    def stop(self, timeout=None):
+        """Stop claiming messages, wait for the deliveries in flight and hand back what is left claimed
+
+        @param timeout: Max seconds to wait for the drainer thread, None waits until it is done
+        """
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        self._wakeup.set()
+        self._drainer.join(timeout)
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._db.execute("UPDATE outbound SET state = 'pending', owner = NULL, lease = NULL "
+                             "WHERE state = 'inflight' AND owner = ?", (self.owner,))
+
+    def put(self, message_id, chat_key, url, headers, body, hold=None):
+        """Store a message for delivery. Messages with an already known id are ignored
+
+        @param message_id: Unique id of the message
+        @param chat_key: Ordering key, messages with the same key are delivered in order
+        @param url: Endpoint to POST the message to
+        @param headers: dict of request headers
+        @param body: JSON serializable message
+        @param hold: Seconds the message waits for release() before it is sent with this body, None
+        sends it right away. Later messages of the chat wait behind a held one
+        @return boolean True if queued, False if it is a duplicate
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO outbound (message_id, chat_key, url, headers, body, state, next_attempt, "
+                "created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (message_id, chat_key, url, json.dumps(headers), json.dumps(body),
+                 "pending" if hold is None else "held", now if hold is None else now + hold, now))
+            if not cursor.rowcount:
+                self.duplicates += 1
+                return False
+        self._wakeup.set()
+        return True
+
+    def release(self, message_id, body=None):
+        """Send a held message now
+
+        @param message_id: Unique id of the message
+        @param body: JSON serializable message replacing the one given to put, None keeps it
+        @return boolean True if released, False if it was not held anymore: its hold ran out
+        """
+        with self._lock:
+            if body is None:
+                cursor = self._db.execute(
+                    "UPDATE outbound SET state = 'pending', next_attempt = ? WHERE message_id = ? AND state = 'held'",
+                    (time.time(), message_id))
+            else:
+                cursor = self._db.execute(
+                    "UPDATE outbound SET state = 'pending', next_attempt = ?, body = ? "
+                    "WHERE message_id = ? AND state = 'held'", (time.time(), json.dumps(body), message_id))
+            released = cursor.rowcount > 0
+        if released:
+            self._wakeup.set()
+        return released
+
+    def _claim(self, limit):
+        """Lease the oldest due message of every chat to this queue and return them"""
+        now = time.time()
+        with self._lock:
+            # The write lock is taken before the SELECT, no other process claims between it and the UPDATE
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT seq, message_id, url, headers, body, attempts FROM outbound o "
+                    "WHERE state IN ('pending', 'held') AND next_attempt <= ? AND NOT EXISTS ("
+                    "  SELECT 1 FROM outbound p WHERE p.chat_key = o.chat_key AND p.seq < o.seq"
+                    "  AND p.state IN ('pending', 'held', 'inflight')) "
+                    "ORDER BY seq LIMIT ?", (now, limit)).fetchall()
+                if rows:
+                    self._db.execute(
+                        "UPDATE outbound SET state = 'inflight', owner = ?, lease = ? "
+                        "WHERE state IN ('pending', 'held') AND seq IN ({0})".format(",".join("?" * len(rows))),
+                        [self.owner, now + self.lease] + [row[0] for row in rows])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return rows
+
+    def _renew_leases(self):
+        """Extend the leases of the messages this queue sends, and release the messages whose
+        owner stopped renewing: the process sending them died"""
+        now = time.time()
+        if now - self._last_renew < self.lease / 4.0:
+            return
+        self._last_renew = now
+        with self._lock:
+            self._db.execute("UPDATE outbound SET lease = ? WHERE state = 'inflight' AND owner = ?",
+                             (now + self.lease, self.owner))
+            cursor = self._db.execute(
+                "UPDATE outbound SET state = 'pending', owner = NULL, lease = NULL "
+                "WHERE state = 'inflight' AND (lease IS NULL OR lease < ?)", (now,))
+        if cursor.rowcount:
+            logger.warning(str(cursor.rowcount) + " outbound messages left in flight by a stopped process are sent again")
+
+    def _next_due(self):
+        with self._lock:
+            return self._db.execute("SELECT MIN(next_attempt) FROM outbound WHERE state IN ('pending', 'held')").fetchone()[0]
+
+    def _drain(self):
+        while self._running:
+            try:
+                self._renew_leases()
+                rows = self._claim(self.workers * self.batch_size)
+                if rows:
+                    for batch in self._batches(rows):
+                        self._slots.acquire()
+                        self._executor.submit(self._deliver, batch)
+                    continue
+
+                self._prune()
+                next_due = self._next_due()
+                timeout = 5 if next_due is None else min(max(next_due - time.time(), 0.05), 5)
+                self._wakeup.wait(timeout)
+                self._wakeup.clear()
+            except Exception:
+                logger.exception("Error draining outbound queue")
+                time.sleep(1)
+
+    def _batches(self, rows):
+        if self.batch_size == 1:
+            return [[row] for row in rows]
+        # Only messages with the same headers (same company and recipient) share a POST
+        groups = collections.OrderedDict()
+        for row in rows:
+            groups.setdefault(row[3], []).append(row)
+        batches = []
+        for group in groups.values():
+            for start in range(0, len(group), self.batch_size):
+                batches.append(group[start:start + self.batch_size])
+        return batches
+
+    def _deliver(self, batch):
+        try:
+            if len(batch) == 1:
+                url, body = batch[0][2], batch[0][4]
+            else:
+                url, body = self.batch_url, "[" + ",".join(row[4] for row in batch) + "]"
+            headers = json.loads(batch[0][3])
+
+            try:
+                response = self.post(url, headers=headers, data=body.encode("utf-8"))
+            except Exception as e:
+                self._retry(batch, str(e))
+                return
+
+            logger.info("Messages " + ",".join(row[1] for row in batch) + " sent to " + url + " ---- " + str(response))
+            if response.status_code < 300:
+                self._done(batch, "sent", None)
+            elif response.status_code < 500 and response.status_code not in (408, 429):
+                # The backend refused the message, sending it again will not help
+                self._done(batch, "failed", "HTTP " + str(response.status_code))
+            else:
+                self._retry(batch, "HTTP " + str(response.status_code))
+        except Exception:
+            logger.exception("Error delivering outbound messages")
+        finally:
+            self._slots.release()
+            self._wakeup.set()
+
+    def _done(self, batch, state, error):
+        with self._lock:
+            self._db.executemany(
+                "UPDATE outbound SET state = ?, attempts = attempts + 1, last_error = ?, owner = NULL, lease = NULL "
+                "WHERE seq = ? AND owner = ?",
+                [(state, error, row[0], self.owner) for row in batch])
+            if state == "sent":
+                now = time.time()
+                self._sent_times.extend([now] * len(batch))
+
+    def _retry(self, batch, error):
+        logger.error("Delivery of messages " + ",".join(row[1] for row in batch) + " failed: " + error)
+        updates = []
+        for row in batch:
+            attempts = row[5] + 1
+            if attempts >= self.max_attempts:
+                updates.append(("failed", attempts, time.time(), error, row[0], self.owner))
+                continue
+            delay = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+            # Jitter keeps retries of many chats from hitting the backend at the same time
+            delay = delay * (0.5 + random.random() / 2)
+            updates.append(("pending", attempts, time.time() + delay, error, row[0], self.owner))
+        with self._lock:
+            self.retries += len(batch)
+            self._db.executemany(
+                "UPDATE outbound SET state = ?, attempts = ?, next_attempt = ?, last_error = ?, owner = NULL, "
+                "lease = NULL WHERE seq = ? AND owner = ?", updates)
+
+    def _prune(self):
+        """Forget delivered messages once past the retention period"""
+        now = time.time()
+        if now - self._last_prune < 600:
+            return
+        self._last_prune = now
+        with self._lock:
+            self._db.execute("DELETE FROM outbound WHERE state = 'sent' AND created < ?", (now - self.retention,))
+
+    def get_metrics(self):
+        """Queue depth, drain rate and delivery counters"""
+        now = time.time()
+        with self._lock:
+            counts = dict(self._db.execute("SELECT state, COUNT(*) FROM outbound GROUP BY state").fetchall())
+            oldest = self._db.execute(
+                "SELECT MIN(created) FROM outbound WHERE state IN ('pending', 'held', 'inflight')").fetchone()[0]
+            while self._sent_times and self._sent_times[0] < now - 60:
+                self._sent_times.popleft()
+            sent_last_minute = len(self._sent_times)
+            return {
+                "depth": counts.get("pending", 0) + counts.get("held", 0) + counts.get("inflight", 0),
+                "pending": counts.get("pending", 0),
+                "held": counts.get("held", 0),
+                "inflight": counts.get("inflight", 0),
+                "failed": counts.get("failed", 0),
+                "sent_last_minute": sent_last_minute,
+                "drain_rate": sent_last_minute / 60.0,
+                "oldest_pending_age": now - oldest if oldest else 0,
+                "retries": self.retries,
+                "duplicates": self.duplicates,
+            }
@@ -0,0 +1,154 @@
+"""
+Bridge to Randy, the Twilio style bot answering messages of some clients.
+
+A message is posted as the form Twilio would send, the TwiML answer is parsed while it is read and
+every <Message> of it is sent back to the chat in one browser call.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import closing
+from xml.etree.ElementTree import XMLPullParser
+
+
+class LatencyHistogram(object):
+    """
+    Counts of durations by bucket, with their total
+    """
+
+    # Upper bounds in seconds, the last bucket holds everything slower
+    BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def get_metrics(self):
+        labels = ["<=" + str(bound) for bound in self.BOUNDS] + [">" + str(self.BOUNDS[-1])]
+        return {
+            "count": self.count,
+            "average": self.total / self.count if self.count else None,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class RandyClient(object):
+    """
+    Posts messages to Randy over a shared HTTP client and replies with its answer
+    """
+
+    STAGES = ("post", "parse", "send", "total")
+    _CHUNK_SIZE = 8192
+
+    def __init__(self, url, http_client, account_sid):
+        """
+        @param self:
+        @param url: Randy endpoint
+        @param http_client: Pooled client with request(method, url, **kwargs), see app.HttpClient
+        @param account_sid: Twilio account id sent with every message
+        """
+        self.url = url
+        self.http_client = http_client
+        self.account_sid = account_sid
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+
+    def build_form(self, message):
+        """Form Twilio posts for an incoming WhatsApp message
+
+        @param message: webwhatsapi Message
+        @return dict
+        """
+        sid = 'SM0{0}'.format(message.id)
+        recipient = message._js_obj["to"].replace("@c.us", "")
+        form = {
+            'SmsMessageSid': sid,
+            'NumMedia': '0',
+            'ProfileName': message._js_obj['sender']['pushname'],
+            'SmsSid': sid,
+            'WaId': recipient,
+            'SmsStatus': 'received',
+            'Body': message.content,
+            'To': 'whatsapp:+{0}'.format(recipient),
+            'NumSegments': '1',
+            'MessageSid': sid,
+            'AccountSid': self.account_sid,
+            'From': 'whatsapp:+{0}'.format(message.chat_id.replace("@c.us", "")),
+            'ApiVersion': '2010-04-01',
+        }
+        if message.type == 'location':
+            form['latitude'] = message.latitude
+            form['longitude'] = message.longitude
+        return form
+
+    @staticmethod
+    def iter_messages(chunks):
+        """Bodies of the <Message> elements of a TwiML document, each one as soon as it is parsed
+
+        @param chunks: Iterable of bytes of the document
+        @return generator of strings
+        """
+        parser = XMLPullParser(events=("end",))
+        for chunk in chunks:
+            parser.feed(chunk)
+            for _, element in parser.read_events():
+                if element.tag != "Message":
+                    continue
+                # <Message><Body>text</Body></Message> or <Message>text</Message>
+                body = element.find("Body")
+                yield (body.text if body is not None else element.text) or ""
+                element.clear()
+        parser.close()
+
+    def reply(self, message, chat):
+        """Post a message to Randy and send its answer to the chat
+
+        @param message: webwhatsapi Message
+        @param chat: Chat to answer in
+        @return list of the sent texts
+        """
+        started = time.time()
+        posted = None
+        try:
+            response = self.http_client.request("POST", self.url, data=self.build_form(message), stream=True)
+            posted = time.time()
+            with closing(response):
+                # Randy answering 4xx/5xx fails like an unreachable Randy
+                response.raise_for_status()
+                bodies = list(self.iter_messages(response.iter_content(self._CHUNK_SIZE)))
+        except Exception:
+            failed = time.time()
+            with self._lock:
+                self.failed += 1
+                self._histograms["post"].add((posted or failed) - started)
+                self._histograms["total"].add(failed - started)
+            raise
+        parsed = time.time()
+
+        if bodies:
+            # All parts of the answer go out in one browser call
+            chat.send_messages(bodies)
+        sent = time.time()
+
+        with self._lock:
+            self._histograms["post"].add(posted - started)
+            self._histograms["parse"].add(parsed - posted)
+            self._histograms["send"].add(sent - parsed)
+            self._histograms["total"].add(sent - started)
+        return bodies
+
+    def get_metrics(self):
+        """Latency histograms by stage: post until the response headers, read and parse of the answer,
+        send to the chat. Failed calls, unreachable Randy or an HTTP error, count in post and total"""
+        with self._lock:
+            metrics = {stage: histogram.get_metrics() for stage, histogram in self._histograms.items()}
+            metrics["failed"] = self.failed
+            return metrics
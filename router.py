@@ -0,0 +1,327 @@
+"""
+******************************************************************
+
+        File name   : router.py
+        Description : Front router of the sharded deployment
+
+                      Starts WHATSAPP_SHARDS worker processes running
+                      app.py, each owning the clients a consistent
+                      hash ring maps to it, and forwards every request
+                      to the worker of its client_id. Drivers, timers,
+                      payloads and JSON decoding of a client stay in
+                      one process, different clients use different
+                      cores. Adding a worker only moves the clients
+                      the new worker takes over.
+
+                      Admin requests without a client are sent to all
+                      workers and their answers returned by shard.
+
+                      Run with: WHATSAPP_SHARDS=4 python router.py
+
+        Requirements: Mentioned in requirements.txt
+
+*****************************************************************/
+"""
+
+import atexit
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import Flask, Response, jsonify, request
+from requests.adapters import HTTPAdapter
+
+from hash_ring import HashRing
+from log_writer import LogWriter, parse_levels
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+"""
+##############################
+##### CLASS DEFINITION #######
+##############################
+"""
+
+
+class Worker(object):
+    """
+    An app.py process serving one shard, started again when it exits
+    """
+
+    def __init__(self, name, port, shards):
+        """
+        @param self:
+        @param name: Shard name
+        @param port: Local port the worker listens on
+        @param shards: Names of all shards, the worker builds the same ring
+        """
+        self.name = name
+        self.port = port
+        self.url = "http://127.0.0.1:" + str(port)
+        self.shards = shards
+        self.restarts = 0
+        self.requests = 0
+        self.errors = 0
+        self.process = None
+
+    def start(self):
+        env = dict(os.environ)
+        env.update({
+            "WHATSAPP_SHARD": self.name,
+            "WHATSAPP_SHARDS": ",".join(self.shards),
+            "WHATSAPP_PORT": str(self.port),
+        })
+        self.process = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, "app.py")], cwd=BASE_DIR, env=env)
+        logger.info("Started worker " + self.name + " on port " + str(self.port) + " pid " + str(self.process.pid))
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if self.is_alive():
+            self.process.terminate()
+            try:
+                self.process.wait(WORKER_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def get_info(self):
+        return {
+            "url": self.url,
+            "pid": self.process.pid if self.process else None,
+            "alive": self.is_alive(),
+            "restarts": self.restarts,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+"""
+##############################
+##### GLOBAL VARIABLES #######
+##############################
+"""
+
+# Logs are written as JSON lines by a background thread, workers log to their own files
+LOG_PATH = BASE_DIR + "/whatsapp_router.log"
+LOG_LEVELS = {"werkzeug": "WARNING", "urllib3": "WARNING"}
+LOG_LEVELS.update(parse_levels(os.environ.get("WHATSAPP_LOG_LEVELS")))
+
+log_writer = LogWriter(LOG_PATH, os.environ.get("WHATSAPP_LOG_LEVEL", "INFO"), LOG_LEVELS)
+
+logger = logging.getLogger("WhatsApp Router")
+
+HOST = "0.0.0.0"
+PORT = 8888
+# Workers listen on WORKER_BASE_PORT, WORKER_BASE_PORT + 1, ...
+WORKER_BASE_PORT = 9100
+# Defaults to one worker per core
+SHARD_COUNT = int(os.environ.get("WHATSAPP_SHARDS") or os.cpu_count() or 1)
+# Seconds between two checks of the worker processes
+WORKER_CHECK_INTERVAL = 5
+WORKER_STOP_TIMEOUT = 30
+# (connect, read) seconds of a forwarded request, QR and media routes can be slow
+FORWARD_TIMEOUT = (5, 300)
+FORWARD_CHUNK_SIZE = 64 * 1024
+
+# Not forwarded as they only describe one connection
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers",
+    "transfer-encoding", "upgrade", "host", "content-length",
+}
+
+# Shard names are stable, the ring stays the same for the existing shards when one is added
+shard_names = ["shard-" + str(index) for index in range(SHARD_COUNT)]
+ring = HashRing(shard_names)
+workers = {name: Worker(name, WORKER_BASE_PORT + index, shard_names) for index, name in enumerate(shard_names)}
+
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=SHARD_COUNT, pool_maxsize=64)
+session.mount("http://", adapter)
+
+fanout_executor = ThreadPoolExecutor(max_workers=SHARD_COUNT)
+
+"""
+##############################
+##### FUNCTION DEFINITION ####
+##############################
+"""
+
+
+def get_client_id(request):
+    """Client a request belongs to, as app.py reads it
+
+    @param request: flask request
+    @return client id, None for requests of no client
+    """
+    client_id = request.headers.get("client_id")
+    if not client_id and request.path.startswith("/open/receive/"):
+        client_id = request.path.split("/")[3]
+    return client_id
+
+
+def get_forward_args(request):
+    """Method, path, headers and body of a request, as forwarded to a worker
+
+    @param request: flask request
+    @return dict of keyword arguments for forward
+    """
+    return {
+        "method": request.method,
+        "path": request.full_path if request.query_string else request.path,
+        "headers": {key: value for key, value in request.headers.items() if key.lower() not in HOP_BY_HOP_HEADERS},
+        "data": request.get_data(),
+    }
+
+
+def forward(worker, method, path, headers, data):
+    """Send a request to a worker
+
+    @param worker: Worker object
+    @param method: HTTP method
+    @param path: Path and query string
+    @param headers: dict of request headers
+    @param data: Request body
+    @return streamed requests.Response
+    """
+    worker.requests += 1
+    try:
+        return session.request(
+            method,
+            worker.url + path,
+            headers=headers,
+            data=data,
+            stream=True,
+            allow_redirects=False,
+            timeout=FORWARD_TIMEOUT,
+        )
+    except requests.RequestException:
+        worker.errors += 1
+        raise
+
+
+def fan_out(request):
+    """Send a request to every worker
+
+    @param request: flask request
+    @return dict shard name -> JSON answer of the worker
+    """
+    # The request context is not available to the executor threads
+    forward_args = get_forward_args(request)
+
+    def call(worker):
+        try:
+            response = forward(worker, **forward_args)
+            try:
+                return response.json()
+            finally:
+                response.close()
+        except (requests.RequestException, ValueError) as e:
+            return {"error": str(e)}
+
+    futures = {name: fanout_executor.submit(call, worker) for name, worker in workers.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+def split_clients(request):
+    """Split the clients form field of a request by shard
+
+    @param request: flask request
+    @return dict shard name -> form data with the clients of that shard
+    """
+    by_shard = {}
+    for client_id in request.form.get("clients", "").split(","):
+        if client_id:
+            by_shard.setdefault(ring.get_node(client_id), []).append(client_id)
+    return {name: dict(request.form, clients=",".join(client_ids)) for name, client_ids in by_shard.items()}
+
+
+def supervise():
+    """Start workers again when they exit"""
+    while True:
+        time.sleep(WORKER_CHECK_INTERVAL)
+        for worker in workers.values():
+            if not worker.is_alive():
+                logger.error("Worker " + worker.name + " exited, starting it again")
+                worker.restarts += 1
+                worker.start()
+
+
+def start_workers():
+    log_writer.start()
+    # Registered before stop_workers, so it runs last and writes what stopping the workers logs
+    atexit.register(log_writer.stop)
+    for worker in workers.values():
+        worker.start()
+    atexit.register(stop_workers)
+    supervisor = threading.Thread(target=supervise, name="worker-supervisor")
+    supervisor.daemon = True
+    supervisor.start()
+
+
+def stop_workers():
+    for worker in workers.values():
+        worker.stop()
+
+
+# -------------------------- ROUTES -----------------------------------
+
+app = Flask(__name__)
+
+
+@app.route("/router/shards", methods=["GET"])
+def get_shards():
+    """Workers of the router, and the shard of the given client_ids"""
+    clients = request.args.get("clients")
+    return jsonify({
+        "shards": {name: worker.get_info() for name, worker in workers.items()},
+        "clients": {client_id: ring.get_node(client_id) for client_id in clients.split(",")} if clients else {},
+    })
+
+
+@app.route("/", defaults={"path": ""}, methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
+@app.route("/<path:path>", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
+def route(path):
+    client_id = get_client_id(request)
+
+    if not client_id and path.startswith("admin/"):
+        if request.method == "PUT" and path == "admin/clients":
+            result = {}
+            forward_args = get_forward_args(request)
+            # requests encodes the form again, with its own content type
+            forward_args["headers"].pop("Content-Type", None)
+            for name, form in split_clients(request).items():
+                response = forward(workers[name], **dict(forward_args, data=form))
+                result.update(response.json())
+                response.close()
+            return jsonify(result)
+        return jsonify(fan_out(request))
+
+    # Requests of no client, like the ping routes, can be served by any worker
+    worker = workers[ring.get_node(client_id or "")]
+    try:
+        upstream = forward(worker, **get_forward_args(request))
+    except requests.RequestException as e:
+        logger.error("Worker " + worker.name + " unreachable: " + str(e))
+        return jsonify({"error": "worker " + worker.name + " is unavailable"}), 503
+
+    headers = [(key, value) for key, value in upstream.raw.headers.items() if key.lower() not in HOP_BY_HOP_HEADERS]
+
+    def stream():
+        try:
+            for chunk in upstream.raw.stream(FORWARD_CHUNK_SIZE, decode_content=False):
+                yield chunk
+        finally:
+            upstream.close()
+
+    return Response(stream(), status=upstream.status_code, headers=headers)
+
+
+if __name__ == "__main__":
+    start_workers()
+    app.run(port=PORT, host=HOST, threaded=True)
@@ -0,0 +1,170 @@
+"""
+Background sending of outgoing messages, one lane per chat.
+"""
+
+import collections
+import heapq
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("WhatsApp Backend")
+
+
+class SendScheduler(object):
+    """
+    Sends outgoing messages in the background. Every chat has its own lane:
+    jobs of a chat run one after another, step by step, with at least
+    min_gap seconds between two steps. Lanes of different chats run in
+    parallel on a fixed pool of workers, waiting lanes hold no thread
+    """
+
+    def __init__(self, workers, min_gap, retention=3600):
+        """ Starts the scheduler thread
+        @param self:
+        @param workers: Number of worker threads running the steps
+        @param min_gap: Min seconds between two steps sent to the same chat
+        @param retention: Seconds a finished job can still be queried
+        """
+        self.min_gap = min_gap
+        self.retention = retention
+        self.sent = 0
+        self.failed = 0
+        self._lock = threading.Condition()
+        self._lanes = dict()
+        self._due = []
+        self._jobs = collections.OrderedDict()
+        self._running = True
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        thread = threading.Thread(target=self._schedule, name="send-scheduler")
+        thread.daemon = True
+        thread.start()
+
+    def submit(self, chat_key, steps):
+        """Queue a job at the end of the chat's lane
+
+        @param chat_key: Ordering key of the chat, client_id:chat_id
+        @param steps: list of functions sending one part of the job each
+        @return string job ID
+        """
+        job = {
+            "jobId": uuid.uuid4().hex,
+            "chatKey": chat_key,
+            "status": "queued",
+            "steps": len(steps),
+            "completed": 0,
+            "result": None,
+            "error": None,
+            "created": time.time(),
+            "finished": None,
+        }
+        with self._lock:
+            self._prune()
+            self._jobs[job["jobId"]] = job
+            if not steps:
+                job["status"] = "done"
+                job["finished"] = job["created"]
+                return job["jobId"]
+            lane = self._lanes.get(chat_key)
+            if lane is None:
+                lane = self._lanes[chat_key] = {"jobs": collections.deque(), "next_send": 0, "active": False}
+            lane["jobs"].append((job, collections.deque(steps)))
+            if not lane["active"]:
+                self._activate(chat_key, lane)
+        return job["jobId"]
+
+    def get_job(self, job_id):
+        """Status of a job, None if unknown or expired
+
+        @param job_id: ID returned by submit
+        @return dict copy of the job
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _activate(self, chat_key, lane):
+        lane["active"] = True
+        heapq.heappush(self._due, (max(lane["next_send"], time.time()), chat_key))
+        self._lock.notify()
+
+    def stop(self):
+        """Stop scheduling, wait for the steps running. Jobs still queued are not sent"""
+        with self._lock:
+            self._running = False
+            queued = sum(len(lane["jobs"]) for lane in self._lanes.values())
+            self._lock.notify()
+        if queued:
+            logger.warning(str(queued) + " send jobs dropped on shutdown")
+        self._executor.shutdown(wait=True)
+
+    def _schedule(self):
+        while True:
+            with self._lock:
+                while self._running and (not self._due or self._due[0][0] > time.time()):
+                    self._lock.wait(self._due[0][0] - time.time() if self._due else None)
+                if not self._running:
+                    return
+                _, chat_key = heapq.heappop(self._due)
+            try:
+                self._executor.submit(self._run_step, chat_key)
+            except RuntimeError:
+                # Stopped between the pop and the submit
+                return
+
+    def _run_step(self, chat_key):
+        with self._lock:
+            lane = self._lanes[chat_key]
+            job, steps = lane["jobs"][0]
+            job["status"] = "running"
+            step = steps.popleft()
+
+        try:
+            result = step()
+            error = None
+        except Exception as e:
+            logger.exception("Error sending job " + job["jobId"] + " to " + chat_key)
+            result = None
+            error = str(e)
+
+        with self._lock:
+            lane["next_send"] = time.time() + self.min_gap
+            if error is None:
+                self.sent += 1
+                job["completed"] += 1
+                if result:
+                    job["result"] = result
+            else:
+                # Later steps depend on this one, drop them
+                self.failed += 1
+                job["error"] = error
+                steps.clear()
+            if not steps:
+                job["status"] = "failed" if error else "done"
+                job["finished"] = time.time()
+                lane["jobs"].popleft()
+
+            if lane["jobs"]:
+                self._activate(chat_key, lane)
+            else:
+                del self._lanes[chat_key]
+
+    def _prune(self):
+        expired = time.time() - self.retention
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if job["finished"] is None or job["finished"] > expired:
+                break
+            self._jobs.popitem(last=False)
+
+    def get_metrics(self):
+        """Waiting work of the scheduler"""
+        with self._lock:
+            return {
+                "active_chats": len(self._lanes),
+                "queued_jobs": sum(len(lane["jobs"]) for lane in self._lanes.values()),
+                "sent": self.sent,
+                "failed": self.failed,
+            }
@@ -0,0 +1,114 @@
+"""
+Restore of saved client sessions at startup, a few browsers at a time.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger("WhatsApp Backend")
+
+
+class RestoreScheduler(object):
+    """
+    Brings saved client sessions back at startup, a few browsers at a time so
+    the machine is not flooded with Chrome launches. Clients are restored in
+    the order given, progress of each is kept for the admin routes
+    """
+
+    PENDING = "pending"
+    RESTORING = "restoring"
+    RESTORED = "restored"
+    FAILED = "failed"
+
+    def __init__(self, restore):
+        """
+        @param self:
+        @param restore: Function restoring the session of a client id, None when restores are run by the caller
+        """
+        self.concurrency = None
+        self._restore = restore
+        self._lock = threading.Lock()
+        self._queue = collections.deque()
+        # client id -> {"state", "started", "finished", "error"}, in restore order
+        self._clients = collections.OrderedDict()
+        self._started = None
+
+    def start(self, client_ids, concurrency):
+        """Queue client sessions and restore them in the background
+
+        @param client_ids: IDs of client users, most important first
+        @param concurrency: Number of sessions restored at the same time
+        """
+        self.track(client_ids, concurrency)
+        with self._lock:
+            self._queue.extend(client_ids)
+        for i in range(min(concurrency, len(client_ids))):
+            thread = threading.Thread(target=self._run, name="session-restore-" + str(i))
+            thread.daemon = True
+            thread.start()
+
+    def track(self, client_ids, concurrency):
+        """Record client sessions as pending
+
+        @param client_ids: IDs of client users
+        @param concurrency: Number of sessions restored at the same time
+        """
+        with self._lock:
+            self.concurrency = concurrency
+            if self._started is None:
+                self._started = time.time()
+            for client_id in client_ids:
+                self._clients[client_id] = {"state": self.PENDING, "started": None, "finished": None, "error": None}
+
+    def set_state(self, client_id, state, error=None):
+        """Record the progress of a client session
+
+        @param client_id: ID of client user
+        @param state: One of PENDING, RESTORING, RESTORED and FAILED
+        @param error: Reason of a failure
+        """
+        with self._lock:
+            progress = self._clients.setdefault(client_id, {"state": None, "started": None, "finished": None,
+                                                            "error": None})
+            progress["state"] = state
+            progress["error"] = error
+            if state == self.RESTORING:
+                progress["started"] = time.time()
+            elif state in (self.RESTORED, self.FAILED):
+                progress["finished"] = time.time()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    return
+                client_id = self._queue.popleft()
+            self.set_state(client_id, self.RESTORING)
+            try:
+                self._restore(client_id)
+                self.set_state(client_id, self.RESTORED)
+            except Exception as e:
+                logger.exception("Session Restoration for client " + str(client_id) + " failed")
+                self.set_state(client_id, self.FAILED, str(e))
+
+    def get_progress(self):
+        """Counts per state and progress of every client"""
+        with self._lock:
+            counts = collections.Counter(progress["state"] for progress in self._clients.values())
+            durations = [progress["finished"] - progress["started"] for progress in self._clients.values()
+                         if progress["started"] and progress["finished"]]
+            done = counts[self.RESTORED] + counts[self.FAILED]
+            return {
+                "concurrency": self.concurrency,
+                "total": len(self._clients),
+                "pending": counts[self.PENDING],
+                "restoring": counts[self.RESTORING],
+                "restored": counts[self.RESTORED],
+                "failed": counts[self.FAILED],
+                "complete": done == len(self._clients),
+                "elapsed_seconds": time.time() - self._started if self._started else None,
+                "average_restore_seconds": sum(durations) / len(durations) if durations else None,
+                "clients": [dict(progress, client_id=client_id) for client_id, progress in self._clients.items()],
+            }
@@ -1,19 +1,15 @@
-import binascii
-from asyncio import CancelledError, get_event_loop, sleep
+from asyncio import CancelledError, Semaphore, get_event_loop, sleep
 from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 
 import aiohttp
-from axolotl.kdf.hkdfv3 import HKDFv3
-from axolotl.util.byteutil import ByteUtil
 from base64 import b64decode
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from functools import partial
 from io import BytesIO
 from selenium.common.exceptions import TimeoutException
 
-from . import WhatsAPIDriver
+from .driver import WhatsAPIDriver
+from .media_crypto import MediaDecryptor
 
 logger = getLogger(__name__)
 
@@ -31,9 +27,14 @@ class WhatsAPIDriverAsync:
         logger=None,
         extra_params=None,
         loop=None,
+        chrome_options=None,
+        media_cache=None,
+        max_parallel_downloads=4,
+        driver=None,
     ):
 
-        self._driver = WhatsAPIDriver(
+        # An already connected WhatsAPIDriver can be wrapped as is
+        self._driver = driver or WhatsAPIDriver(
             client=client,
             username=username,
             proxy=proxy,
@@ -44,10 +45,16 @@ class WhatsAPIDriverAsync:
             logger=logger,
             autoconnect=False,
             extra_params=extra_params,
+            chrome_options=chrome_options,
+            media_cache=media_cache,
         )
 
         self.loop = loop or get_event_loop()
         self._pool_executor = ThreadPoolExecutor(max_workers=1)
+        # Created on first download, from inside the loop
+        self._max_parallel_downloads = max_parallel_downloads
+        self._download_slots = None
+        self._http_session = None
 
     async def _run_async(self, method, *args, **kwargs):
         try:
@@ -82,8 +89,23 @@ class WhatsAPIDriverAsync:
                 await sleep(1)
         raise TimeoutException("Timeout: Not logged")
 
-    async def get_qr(self):
-        return await self._run_async(self._driver.get_qr)
+    async def is_logged_in(self):
+        return await self._run_async(self._driver.is_logged_in)
+
+    async def get_id(self):
+        return await self._run_async(self._driver.get_id)
+
+    async def save_sessions(self):
+        return await self._run_async(self._driver.save_sessions)
+
+    async def get_qr(self, filename=None):
+        return await self._run_async(self._driver.get_qr, filename)
+
+    async def get_qr_plain(self):
+        return await self._run_async(self._driver.get_qr_plain)
+
+    async def get_qr_base64(self):
+        return await self._run_async(self._driver.get_qr_base64)
 
     async def screenshot(self, filename):
         return await self._run_async(self._driver.screenshot, filename)
@@ -95,28 +117,38 @@ class WhatsAPIDriverAsync:
         for chat_id in await self.get_all_chat_ids():
             yield await self.get_chat_from_id(chat_id)
 
+    async def get_all_chats_list(self):
+        return await self._run_async(self._driver.get_all_chats)
+
     async def get_all_chat_ids(self):
         return await self._run_async(self._driver.get_all_chat_ids)
 
     async def get_unread(
-        self, include_me=False, include_notifications=False, use_unread_count=False
+        self, include_me=False, include_notifications=False, use_unread_count=False, mark_seen=False
     ):
         return await self._run_async(
             self._driver.get_unread,
             include_me=include_me,
             include_notifications=include_notifications,
             use_unread_count=use_unread_count,
+            mark_seen=mark_seen,
         )
 
+    async def get_new_message_groups(self, timeout=5):
+        return await self._run_async(self._driver.get_new_message_groups, timeout)
+
     async def get_all_messages_in_chat(
         self, chat, include_me=False, include_notifications=False
     ):
-        return await self._run_async(
-            self._driver.get_all_messages_in_chat,
-            chat=chat,
-            include_me=include_me,
-            include_notifications=include_notifications,
-        )
+        # The sync driver yields lazily, collect in the executor so the browser is not hit from the loop
+        def get_messages():
+            return list(
+                self._driver.get_all_messages_in_chat(
+                    chat, include_me=include_me, include_notifications=include_notifications
+                )
+            )
+
+        return await self._run_async(get_messages)
 
     async def get_contact_from_id(self, contact_id):
         return await self._run_async(self._driver.get_contact_from_id, contact_id)
@@ -133,6 +165,9 @@ class WhatsAPIDriverAsync:
     async def get_status(self):
         return await self._run_async(self._driver.get_status)
 
+    def invalidate_status(self):
+        self._driver.invalidate_status()
+
     async def check_number_status(self, number_id):
         return await self._run_async(self._driver.check_number_status, number_id)
 
@@ -148,6 +183,21 @@ class WhatsAPIDriverAsync:
             self._driver.chat_send_message, chat_id=chat_id, message=message
         )
 
+    async def chat_send_messages(self, chat_id, messages):
+        return await self._run_async(self._driver.chat_send_messages, chat_id, messages)
+
+    async def chat_send_seen(self, chat_id):
+        return await self._run_async(self._driver.chat_send_seen, chat_id)
+
+    async def chats_send_seen(self, chat_ids):
+        return await self._run_async(self._driver.chats_send_seen, chat_ids)
+
+    async def send_message_to_id(self, recipient, message):
+        return await self._run_async(self._driver.send_message_to_id, recipient, message)
+
+    async def send_media(self, path, chatid, caption):
+        return await self._run_async(self._driver.send_media, path, chatid, caption)
+
     async def chat_get_messages(
         self, chat, include_me=False, include_notifications=False
     ):
@@ -171,6 +221,9 @@ class WhatsAPIDriverAsync:
     async def get_message_by_id(self, message_id):
         return await self._run_async(self._driver.get_message_by_id, message_id)
 
+    async def save_message_media(self, message, path, force_download=False):
+        return await self._run_async(message.save_media, path, force_download)
+
     async def chat_load_earlier_messages(self, chat_id):
         return await self._run_async(self._driver.chat_load_earlier_messages, chat_id)
 
@@ -205,36 +258,61 @@ class WhatsAPIDriverAsync:
         for admin_id in admin_ids:
             yield await self.get_contact_from_id(admin_id)
 
+    def _get_http_session(self):
+        if self._http_session is None:
+            self._http_session = aiohttp.ClientSession()
+            self._download_slots = Semaphore(self._max_parallel_downloads)
+        return self._http_session
+
     async def download_file(self, url):
-        async with aiohttp.ClientSession() as session:
+        session = self._get_http_session()
+        async with self._download_slots:
             async with session.get(url) as resp:
                 return await resp.read()
 
     async def download_media(self, media_msg, force_download=False):
+        chunks = [chunk async for chunk in self.iter_media(media_msg, force_download)]
+        return BytesIO(b"".join(chunks))
+
+    async def iter_media(self, media_msg, force_download=False, chunk_size=1024 * 1024):
+        """
+        Downloads the encrypted file straight from its URL and decrypts it chunk by chunk,
+        the MAC is checked at the end
+        """
         if not force_download:
             try:
                 if media_msg.content:
-                    return BytesIO(b64decode(media_msg.content))
+                    yield b64decode(media_msg.content)
+                    return
             except AttributeError:
                 pass
 
-        file_data = await self.download_file(media_msg.client_url)
-
-        media_key = b64decode(media_msg.media_key)
-        derivative = HKDFv3().deriveSecrets(
-            media_key, binascii.unhexlify(media_msg.crypt_keys[media_msg.type]), 112
-        )
-
-        parts = ByteUtil.split(derivative, 16, 32)
-        iv = parts[0]
-        cipher_key = parts[1]
-        e_file = file_data[:-10]
-
-        cr_obj = Cipher(
-            algorithms.AES(cipher_key), modes.CBC(iv), backend=default_backend()
-        )
-        decryptor = cr_obj.decryptor()
-        return BytesIO(decryptor.update(e_file) + decryptor.finalize())
+        decryptor = MediaDecryptor(media_msg.media_key, media_msg.crypt_keys[media_msg.type])
+        started = False
+        try:
+            session = self._get_http_session()
+            async with self._download_slots:
+                async with session.get(media_msg.client_url) as resp:
+                    resp.raise_for_status()
+                    async for chunk in resp.content.iter_chunked(chunk_size):
+                        started = True
+                        yield decryptor.update(chunk)
+        except CancelledError:
+            raise
+        except Exception as e:
+            # Halfway through, the chunks already given out cannot be taken back
+            if started:
+                raise
+            logger.warning("Direct download failed (%s), downloading in the browser", e)
+            chunks = self._driver.iter_download(media_msg.client_url, chunk_size)
+            while True:
+                chunk = await self._run_async(next, chunks, None)
+                if chunk is None:
+                    break
+                yield decryptor.update(chunk)
+        yield decryptor.finalize()
 
     async def quit(self):
+        if self._http_session is not None:
+            await self._http_session.close()
         return await self._run_async(self._driver.quit)
@@ -1,6 +1,15 @@
 URL = "http://web.whatsapp.com"
 
 
+class WhatsAPIDriverStatus(object):
+    Unknown = "Unknown"
+    NoDriver = "NoDriver"
+    NotConnected = "NotConnected"
+    NotLoggedIn = "NotLoggedIn"
+    LoggedIn = "LoggedIn"
+    LoggedInAnotherBrowser = "LoggedInAnotherBrowser"
+
+
 class Selectors(object):
     FIRST_RUN = "#wrapper"
     QR_CODE = ".qrcode > img:nth-child(4)"
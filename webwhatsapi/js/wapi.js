@@ -1277,6 +1277,25 @@ window.WAPI.getUnreadMessages = function (includeMe, includeNotifications, use_u
     return output;
 };
 
+/**
+ * Fetches unread messages like getUnreadMessages and sends a seen to every chat they come from
+ *
+ * @param done Optional callback function for async execution
+ * @returns {Array} List of unread messages grouped by chats
+ */
+window.WAPI.getUnreadMessagesAndSendSeen = function (includeMe, includeNotifications, use_unread_count, done) {
+    const output = window.WAPI.getUnreadMessages(includeMe, includeNotifications, use_unread_count);
+
+    Promise.all(output.map(function (messageGroup) {
+        return new Promise(function (resolve) {
+            window.WAPI.sendSeen(messageGroup.id, resolve);
+        });
+    })).then(function () {
+        if (done !== undefined) done(output);
+    });
+    return output;
+};
+
 window.WAPI.getGroupOwnerID = async function (id, done) {
     const output = (await WAPI.getGroupMetadata(id)).owner.id;
     if (done !== undefined) {
@@ -1388,6 +1407,59 @@ window.WAPI.downloadFile = function (url, done) {
     xhr.send(null);
 };
 
+/**
+ * Downloads a file into the page and keeps it until released, the driver reads it in chunks
+ * with readDownloadChunk so no single script result holds the whole file
+ *
+ * @param url File URL
+ * @param done Optional callback function for async execution
+ * @returns {Promise} {id, size} of the download, false if it failed
+ */
+window.WAPI._downloads      = {};
+window.WAPI._lastDownloadId = 0;
+
+window.WAPI.startDownload = function (url, done) {
+    return fetch(url).then(function (response) {
+        if (!response.ok) {
+            throw new Error(response.statusText);
+        }
+        return response.blob();
+    }).then(function (blob) {
+        let id = ++window.WAPI._lastDownloadId;
+        window.WAPI._downloads[id] = blob;
+        let output = {id: id, size: blob.size};
+        if (done !== undefined) done(output);
+        return output;
+    }).catch(function (error) {
+        console.error(error);
+        if (done !== undefined) done(false);
+        return false;
+    });
+};
+
+window.WAPI.readDownloadChunk = function (id, offset, length, done) {
+    let blob = window.WAPI._downloads[id];
+    if (blob === undefined) {
+        if (done !== undefined) done(false);
+        return false;
+    }
+    let reader = new FileReader();
+    reader.onload = function () {
+        done(reader.result.substr(reader.result.indexOf(',') + 1));
+    };
+    reader.onerror = function () {
+        done(false);
+    };
+    reader.readAsDataURL(blob.slice(offset, offset + length));
+    return true;
+};
+
+window.WAPI.releaseDownload = function (id, done) {
+    delete window.WAPI._downloads[id];
+    if (done !== undefined) done(true);
+    return true;
+};
+
 window.WAPI.getBatteryLevel = function (done) {
     if (window.Store.Conn.plugged) {
         if (done !== undefined) {
@@ -1494,7 +1566,7 @@ window.WAPI._newMessagesListener = window.Store.Msg.on('add', (newMessage) => {
         }
 
         // Starts debouncer time to don't call a callback for each message if more than one message arrives
-        // in the same second
+        // at once. Kept well under the push wait of the listener, so a wait ends as messages arrive
         if (!window.WAPI._newMessagesDebouncer && window.WAPI._newMessagesQueue.length > 0) {
             window.WAPI._newMessagesDebouncer = setTimeout(() => {
                 let queuedMessages = window.WAPI._newMessagesQueue;
@@ -1518,7 +1590,7 @@ window.WAPI._newMessagesListener = window.Store.Msg.on('add', (newMessage) => {
                     let callbackIndex = window.WAPI._newMessagesCallbacks.indexOf(rmCallbackObj);
                     window.WAPI._newMessagesCallbacks.splice(callbackIndex, 1);
                 });
-            }, 1000);
+            }, 100);
         }
     }
 });
@@ -1566,6 +1638,37 @@ window.WAPI.getBufferedNewMessages = function (done) {
     }
     return bufferedMessages;
 };
+
+/**
+ * Long-poll variant of getBufferedNewMessages. Returns the buffered messages as soon as there
+ * are any, waiting at most `timeout` milliseconds for new ones to arrive.
+ * @param timeout - Number - Max time to wait for new messages, in milliseconds.
+ * @param done - function - Callback function to be called contained the buffered messages.
+ * @returns {boolean}
+ */
+window.WAPI.waitBufferedNewMessages = function (timeout, done) {
+    if (window.WAPI._newMessagesBuffer.length > 0) {
+        window.WAPI.getBufferedNewMessages(done);
+        return true;
+    }
+
+    let callbackObj = { rmAfterUse: true };
+    let timer = setTimeout(function () {
+        // Nothing arrived, unregister ourselves. The debouncer removes the callback otherwise.
+        let callbackIndex = window.WAPI._newMessagesCallbacks.indexOf(callbackObj);
+        if (callbackIndex !== -1) {
+            window.WAPI._newMessagesCallbacks.splice(callbackIndex, 1);
+        }
+        window.WAPI.getBufferedNewMessages(done);
+    }, timeout);
+
+    callbackObj.callback = function () {
+        clearTimeout(timer);
+        window.WAPI.getBufferedNewMessages(done);
+    };
+    window.WAPI._newMessagesCallbacks.push(callbackObj);
+    return true;
+};
 /** End new messages observable functions **/
 
 window.WAPI.sendImage = function (imgBase64, chatid, filename, caption, done) {
@@ -1583,6 +1686,108 @@ return Store.Chat.find(idUser).then((chat) => {
 });
 }
 
+/** Staged media functions **/
+
+/**
+ * Files uploaded into the page once, by content hash. Sending one again only references it
+ */
+window.WAPI._stagedMedia      = {};
+window.WAPI._stagedMediaBytes = 0;
+// Least recently used staged files are dropped above this size
+window.WAPI.STAGED_MEDIA_MAX_BYTES = 256 * 1024 * 1024;
+window.WAPI.MEDIA_NOT_STAGED       = "MediaNotStaged";
+
+/**
+ * File input the driver uploads files through, created on first use
+ *
+ * @param key Content hash of the next uploaded file
+ * @param done Optional callback function for async execution
+ * @returns {HTMLInputElement}
+ */
+window.WAPI.getMediaStageInput = function (key, done) {
+    let input = document.getElementById('wapi-media-stage');
+    if (input === null) {
+        input = document.createElement('input');
+        input.type = 'file';
+        input.id = 'wapi-media-stage';
+        // Not display: none, chromedriver only types into rendered inputs
+        input.style.cssText = 'position: fixed; left: -100px; top: 0; width: 1px; height: 1px; opacity: 0;';
+        document.body.appendChild(input);
+    }
+    input.value = '';
+    input.dataset.key = key;
+    if (done !== undefined) done(input);
+    return input;
+};
+
+window.WAPI._getStagedMedia = function (key) {
+    let staged = window.WAPI._stagedMedia[key];
+    if (staged !== undefined) {
+        // Re-insert as most recently used
+        delete window.WAPI._stagedMedia[key];
+        window.WAPI._stagedMedia[key] = staged;
+        return Promise.resolve(staged);
+    }
+
+    let input = document.getElementById('wapi-media-stage');
+    if (input === null || input.dataset.key !== key || input.files.length === 0) {
+        return Promise.resolve(undefined);
+    }
+    let file = input.files[0];
+    input.value = '';
+    // Copy into page memory, the file on disk may be evicted by the driver's cache
+    return file.arrayBuffer().then(function (buffer) {
+        window.WAPI._stagedMedia[key] = buffer;
+        window.WAPI._stagedMediaBytes += buffer.byteLength;
+        for (let oldKey in window.WAPI._stagedMedia) {
+            if (window.WAPI._stagedMediaBytes <= window.WAPI.STAGED_MEDIA_MAX_BYTES || oldKey === key) {
+                break;
+            }
+            window.WAPI._stagedMediaBytes -= window.WAPI._stagedMedia[oldKey].byteLength;
+            delete window.WAPI._stagedMedia[oldKey];
+        }
+        return buffer;
+    });
+};
+
+/**
+ * Sends a file staged through the stage input
+ *
+ * @param key Content hash of the file
+ * @param chatid Chat to send to
+ * @param filename Name of the file shown in the chat
+ * @param mime MIME type of the file
+ * @param caption Caption of the media
+ * @param done Optional callback function for async execution
+ * @returns MEDIA_NOT_STAGED if the page does not have the file, the driver stages it and calls again
+ */
+window.WAPI.sendStagedMedia = function (key, chatid, filename, mime, caption, done) {
+    return window.WAPI._getStagedMedia(key).then(function (buffer) {
+        if (buffer === undefined) {
+            if (done !== undefined) done(window.WAPI.MEDIA_NOT_STAGED);
+            return window.WAPI.MEDIA_NOT_STAGED;
+        }
+        var idUser = new window.Store.UserConstructor(chatid, { intentionallyUsePrivateConstructor: true });
+        return Store.Chat.find(idUser).then((chat) => {
+            var mediaBlob = new File([buffer], filename, {type: mime});
+            var mc = new Store.MediaCollection(chat);
+            return mc.processAttachments([{file: mediaBlob}, 1], chat, 1).then(() => {
+                var media = mc.models[0];
+                media.sendToChat(chat, { caption: caption });
+                if (done !== undefined) done(true);
+                return true;
+            });
+        });
+    }).catch(function (e) {
+        // The driver waits for done until the script timeout, always answer
+        console.error(e);
+        if (done !== undefined) done(false);
+        return false;
+    });
+};
+
+/** End staged media functions **/
+
 window.WAPI.base64ImageToFile = function (b64Data, filename) {
     var arr   = b64Data.split(',');
     var mime  = arr[0].match(/:(.*?);/)[1];
@@ -0,0 +1,359 @@
+"""
+Cache of media files sent through WhatsApp web.
+
+Downloaded files are kept on disk by URL, the base64 data URI sent to the browser is kept in memory by
+content hash, so sending the same image again neither downloads, reads, sniffs nor encodes it.
+"""
+
+import hashlib
+import mimetypes
+import os
+import threading
+import uuid
+from base64 import b64encode
+from collections import OrderedDict
+
+
+class CachedMedia(object):
+    """
+    A media file ready to be sent
+    """
+
+    def __init__(self, digest, mime, size, data_uri):
+        self.digest = digest
+        self.mime = mime
+        self.size = size
+        self.data_uri = data_uri
+
+
+class MediaCache(object):
+    """
+    Size bounded LRU cache of media files, on disk keyed by URL and in memory keyed by content hash.
+    Safe to share between drivers and threads.
+    """
+
+    # libmagic only needs the start of a file
+    _SNIFF_BYTES = 8192
+    _CHUNK_BYTES = 1024 * 1024
+
+    def __init__(self, directory=None, max_disk_bytes=512 * 1024 * 1024, max_memory_bytes=64 * 1024 * 1024):
+        """
+        :param directory: Folder for downloaded files, None to only cache encoded files in memory
+        :type directory: str
+        :param max_disk_bytes: Size of the folder above which least recently used files are deleted
+        :type max_disk_bytes: int
+        :param max_memory_bytes: Size of the encoded data URIs above which least recently used ones are dropped
+        :type max_memory_bytes: int
+        """
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+
+        self._lock = threading.Lock()
+        self._magic_lock = threading.Lock()
+        self._magic = None
+
+        # file name -> size, least recently used first
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        # path -> (mtime, size, digest, mime), skips reading files already hashed
+        self._digests = dict()
+        # digest -> CachedMedia, least recently used first
+        self._media = OrderedDict()
+        self._memory_bytes = 0
+
+        self.url_hits = 0
+        self.url_misses = 0
+        self.media_hits = 0
+        self.media_misses = 0
+        self.disk_evictions = 0
+        self.memory_evictions = 0
+
+        if directory is not None:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self._load_directory()
+
+    def _load_directory(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".part"):
+                # Left over by an interrupted download
+                os.remove(path)
+            elif os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def get_file(self, url, download, file_name=None):
+        """
+        Local copy of a remote file, downloaded on first use
+
+        :param url: URL of the file
+        :type url: str
+        :param download: Called as download(url, path) on a miss, writes the file and returns True on success
+        :param file_name: Name of the local file, defaults to a name derived from the URL
+        :type file_name: str
+        :return: Path of the local file, None if the download failed
+        :rtype: str
+        """
+        if self.directory is None:
+            raise ValueError("MediaCache has no directory for downloaded files")
+
+        file_name = file_name or str(uuid.uuid5(uuid.NAMESPACE_URL, str(url)))
+        path = os.path.join(self.directory, file_name)
+
+        with self._lock:
+            if file_name in self._disk and os.path.isfile(path):
+                self._disk.move_to_end(file_name)
+                self.url_hits += 1
+                return path
+            self.url_misses += 1
+
+        # Download next to the final file, concurrent misses never see half a file
+        tmp_path = self.get_temp_path(file_name)
+        try:
+            if not download(url, tmp_path):
+                return None
+            return self.add_file(file_name, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get_temp_path(self, file_name):
+        """
+        Path to write a file to before it is complete, see add_file
+
+        :param file_name: Name the file gets once added
+        :type file_name: str
+        :rtype: str
+        """
+        return "{0}.{1}.part".format(os.path.join(self.directory, file_name), uuid.uuid4().hex)
+
+    def add_file(self, file_name, tmp_path):
+        """
+        Moves a complete file into the cache
+
+        :param file_name: Name of the file in the cache
+        :type file_name: str
+        :param tmp_path: Path the file was written to, from get_temp_path
+        :type tmp_path: str
+        :return: Path of the cached file
+        :rtype: str
+        """
+        path = os.path.join(self.directory, file_name)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._disk_bytes += size - self._disk.pop(file_name, 0)
+            self._disk[file_name] = size
+            self._evict_disk()
+        return path
+
+    def _evict_disk(self):
+        # Never evicts the most recent file, it is about to be sent
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            name, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.disk_evictions += 1
+            path = os.path.join(self.directory, name)
+            self._digests.pop(path, None)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get_media(self, path):
+        """
+        Encoded form of a local file, read and encoded only if its content was not seen before
+
+        :param path: file path
+        :type path: str
+        :return: Hash, MIME type, size and data URI of the file
+        :rtype: CachedMedia
+        """
+        stat = os.stat(path)
+        with self._lock:
+            known = self._digests.get(path)
+            if known is not None and known[:2] == (stat.st_mtime, stat.st_size):
+                media = self._get_cached(known[2])
+                if media is not None:
+                    return media
+
+        with open(path, "rb") as media_file:
+            content = media_file.read()
+        digest = hashlib.sha256(content).hexdigest()
+        mime = self.get_mime(content[:self._SNIFF_BYTES])
+
+        with self._lock:
+            self._digests[path] = (stat.st_mtime, stat.st_size, digest, mime)
+            media = self._get_cached(digest)
+            if media is not None:
+                return media
+            self.media_misses += 1
+
+        data_uri = "data:" + mime + ";base64," + b64encode(content).decode("utf-8")
+        media = CachedMedia(digest, mime, len(content), data_uri)
+
+        with self._lock:
+            if digest not in self._media and len(data_uri) <= self.max_memory_bytes:
+                self._media[digest] = media
+                self._memory_bytes += len(data_uri)
+                while self._memory_bytes > self.max_memory_bytes:
+                    _, evicted = self._media.popitem(last=False)
+                    self._memory_bytes -= len(evicted.data_uri)
+                    self.memory_evictions += 1
+        return media
+
+    def identify(self, path):
+        """
+        Content hash and MIME type of a local file. The file is streamed, never held in memory whole
+
+        :param path: file path
+        :type path: str
+        :return: digest and MIME type
+        :rtype: tuple
+        """
+        stat = os.stat(path)
+        with self._lock:
+            known = self._digests.get(path)
+            if known is not None and known[:2] == (stat.st_mtime, stat.st_size):
+                return known[2:]
+
+        sha = hashlib.sha256()
+        with open(path, "rb") as media_file:
+            head = media_file.read(self._SNIFF_BYTES)
+            chunk = head
+            while chunk:
+                sha.update(chunk)
+                chunk = media_file.read(self._CHUNK_BYTES)
+        known = (stat.st_mtime, stat.st_size, sha.hexdigest(), self.get_mime(head))
+
+        with self._lock:
+            self._digests[path] = known
+        return known[2:]
+
+    def _get_cached(self, digest):
+        media = self._media.get(digest)
+        if media is not None:
+            self._media.move_to_end(digest)
+            self.media_hits += 1
+        return media
+
+    def get_mime(self, content):
+        """
+        Sniffs the MIME type of a file content with a single shared libmagic handle
+
+        :param content: File content
+        :type content: bytes
+        :rtype: str
+        """
+        # libmagic handles are not thread safe
+        with self._magic_lock:
+            if self._magic is None:
+                import magic
+
+                self._magic = magic.Magic(mime=True)
+            return self._magic.from_buffer(content)
+
+    def get_metrics(self):
+        """
+        :return: Hit and miss counters and size of both cache levels
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "url_hits": self.url_hits,
+                "url_misses": self.url_misses,
+                "media_hits": self.media_hits,
+                "media_misses": self.media_misses,
+                "disk_files": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "disk_evictions": self.disk_evictions,
+                "memory_items": len(self._media),
+                "memory_bytes": self._memory_bytes,
+                "memory_evictions": self.memory_evictions,
+            }
+
+
+class MediaStore(MediaCache):
+    """
+    Disk store of received media, decrypted, keyed by message. A file is named by the hash of its key plus the
+    extension of its MIME type, so the store is found again in its folder after a restart.
+    """
+
+    def __init__(self, directory, max_disk_bytes=1024 * 1024 * 1024):
+        """
+        :param directory: Folder of the stored files
+        :type directory: str
+        :param max_disk_bytes: Size of the folder above which least recently used files are deleted
+        :type max_disk_bytes: int
+        """
+        # key hash -> file name, filled from the folder once loaded
+        self._names = dict()
+        super(MediaStore, self).__init__(directory, max_disk_bytes, 0)
+        self._names = {name.split(".", 1)[0]: name for name in self._disk}
+
+    @staticmethod
+    def _hash_key(key):
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get_file_name(self, key, mime):
+        """
+        :param key: Key of the media, like client_id:message_id
+        :type key: str
+        :param mime: MIME type of the media
+        :type mime: str
+        :rtype: str
+        """
+        extension = mimetypes.guess_extension(mime.split(";")[0].strip()) if mime else None
+        return self._hash_key(key) + (extension or "")
+
+    def get(self, key):
+        """
+        Stored media of a key
+
+        :param key: Key of the media
+        :type key: str
+        :return: Path and MIME type of the stored file, None if not stored
+        :rtype: tuple
+        """
+        with self._lock:
+            name = self._names.get(self._hash_key(key))
+            path = os.path.join(self.directory, name) if name is not None else None
+            if name is None or name not in self._disk or not os.path.isfile(path):
+                if name is not None:
+                    # Deleted outside of the store, forget it so the media is downloaded again
+                    self._names.pop(self._hash_key(key), None)
+                    self._disk_bytes -= self._disk.pop(name, 0)
+                    self._digests.pop(path, None)
+                self.url_misses += 1
+                return None
+            self._disk.move_to_end(name)
+            self.url_hits += 1
+        return path, mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    def add_file(self, file_name, tmp_path):
+        path = super(MediaStore, self).add_file(file_name, tmp_path)
+        with self._lock:
+            self._names[file_name.split(".", 1)[0]] = file_name
+        return path
+
+    def _evict_disk(self):
+        super(MediaStore, self)._evict_disk()
+        if len(self._names) > len(self._disk):
+            self._names = {key: name for key, name in self._names.items() if name in self._disk}
+
+    def get_metrics(self):
+        with self._lock:
+            return {
+                "hits": self.url_hits,
+                "misses": self.url_misses,
+                "files": len(self._disk),
+                "bytes": self._disk_bytes,
+                "evictions": self.disk_evictions,
+            }
@@ -0,0 +1,99 @@
+"""
+Decryption of WhatsApp media files.
+
+An encrypted media file is AES-256-CBC ciphertext followed by the first 10 bytes of
+HMAC-SHA256(mac_key, iv + ciphertext). The keys are derived from the message's media key with HKDF.
+"""
+
+import binascii
+import hmac
+from base64 import b64decode
+from functools import lru_cache
+from hashlib import sha256
+
+from axolotl.kdf.hkdfv3 import HKDFv3
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+MAC_LENGTH = 10
+
+
+class MediaIntegrityError(Exception):
+    """
+    The MAC of a media file does not match its content
+    """
+
+    def __init__(self, message=None):
+        super(Exception, self).__init__(message)
+
+
+@lru_cache(maxsize=1024)
+def derive_media_keys(media_key, crypt_key):
+    """
+    Expands the media key of a message, cached as the same message is often downloaded again
+
+    :param media_key: Base64 media key of the message
+    :type media_key: str
+    :param crypt_key: Hex encoded HKDF info of the media type, see MediaMessage.crypt_keys
+    :type crypt_key: str
+    :return: iv, cipher key and mac key
+    :rtype: tuple
+    """
+    derivative = HKDFv3().deriveSecrets(
+        b64decode(media_key), binascii.unhexlify(crypt_key), 112
+    )
+    return derivative[:16], derivative[16:48], derivative[48:80]
+
+
+class MediaDecryptor(object):
+    """
+    Decrypts a media file chunk by chunk. Only the trailing MAC and an unfinished AES block are
+    kept between chunks, whatever the size of the file.
+    """
+
+    def __init__(self, media_key, crypt_key):
+        """
+        :param media_key: Base64 media key of the message
+        :type media_key: str
+        :param crypt_key: Hex encoded HKDF info of the media type
+        :type crypt_key: str
+        """
+        iv, cipher_key, mac_key = derive_media_keys(media_key, crypt_key)
+        self._decryptor = Cipher(
+            algorithms.AES(cipher_key), modes.CBC(iv), backend=default_backend()
+        ).decryptor()
+        self._unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+        self._mac = hmac.new(mac_key, iv, sha256)
+        # Last bytes seen, the MAC once the file is complete
+        self._tail = b""
+
+    def update(self, data):
+        """
+        :param data: Next chunk of the encrypted file
+        :type data: bytes
+        :return: Decrypted bytes available so far
+        :rtype: bytes
+        """
+        data = self._tail + data
+        ciphertext, self._tail = data[:-MAC_LENGTH], data[-MAC_LENGTH:]
+        if not ciphertext:
+            return b""
+        self._mac.update(ciphertext)
+        return self._unpadder.update(self._decryptor.update(ciphertext))
+
+    def finalize(self):
+        """
+        Checks the MAC and returns the last decrypted bytes
+
+        :raises MediaIntegrityError: the file is truncated or was tampered with
+        :rtype: bytes
+        """
+        if len(self._tail) != MAC_LENGTH or not hmac.compare_digest(
+            self._mac.digest()[:MAC_LENGTH], self._tail
+        ):
+            raise MediaIntegrityError("Media MAC mismatch")
+        try:
+            return self._unpadder.update(self._decryptor.finalize()) + self._unpadder.finalize()
+        except ValueError as e:
+            raise MediaIntegrityError("Invalid media padding ({0})".format(e))
@@ -37,6 +37,10 @@ class Chat(WhatsappObjectWithId):
     def send_message(self, message):
         return self.driver.chat_send_message(self.id, message)
 
+    @driver_needed
+    def send_messages(self, messages):
+        return self.driver.chat_send_messages(self.id, messages)
+
     @driver_needed
     def send_seen(self):
         return self.driver.chat_send_seen(self.id)
@@ -1,3 +1,4 @@
+import hashlib
 import mimetypes
 import os
 from datetime import datetime
@@ -94,16 +95,17 @@ class MediaMessage(Message):
         self.media_key = self._js_obj.get("mediaKey")
         self.client_url = self._js_obj.get("clientUrl")
 
+        # Same media, same file name, saving it again overwrites it
         extension = mimetypes.guess_extension(self.mime)
-        self.filename = "".join([str(id(self)), extension or ""])
+        self.filename = "".join([
+            hashlib.sha256((self.media_key or self.id).encode("utf-8")).hexdigest()[:32],
+            extension or "",
+        ])
 
     def save_media(self, path, force_download=False):
         # gets full media
         filename = os.path.join(path, self.filename)
-        ioobj = self.driver.download_media(self, force_download)
-        with open(filename, "wb") as f:
-            f.write(ioobj.getvalue())
-        return filename
+        return self.driver.save_media(self, filename, force_download)
 
     def __repr__(self):
         return "<MediaMessage - {type} from {sender} at {timestamp} ({filename})>".format(
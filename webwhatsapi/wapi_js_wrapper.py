@@ -29,9 +29,9 @@ class WapiJsWrapper(object):
         self.wapi_driver = wapi_driver
         self.available_functions = None
 
-        # Starts new messages observable thread.
+        # New messages observable thread. Started on first subscription, so it does not
+        # drain the new messages buffer while nobody is listening.
         self.new_messages_observable = NewMessagesObservable(self, wapi_driver, driver)
-        self.new_messages_observable.start()
 
     def __getattr__(self, item):
         """
@@ -78,6 +78,15 @@ class WapiJsWrapper(object):
             else:
                 return []
 
+    def batch(self):
+        """
+        Starts a batch of calls to functions in window.WAPI
+
+        :return: Batch running all its queued calls in a single script
+        :rtype: JsBatch
+        """
+        return JsBatch(self.driver, self)
+
     def quit(self):
         self.new_messages_observable.stop()
 
@@ -107,6 +116,9 @@ class JsArg(object):
         if isinstance(self.obj, bool):
             return str(self.obj).lower()
 
+        if self.obj is None:
+            return "null"
+
         return str(self.obj)
 
 
@@ -155,6 +167,132 @@ class JsFunction(object):
             )
 
 
+class JsBatch(object):
+    """
+    Queues calls to functions in window.WAPI and runs all of them in one execute_async_script,
+    one WebDriver round trip instead of one per call.
+    Calls run one after another in the order they were added, a failing call does not stop the next ones.
+    A call that never reaches its callback fails once its step timeout is up, the next one runs then.
+    """
+
+    # Milliseconds a single call of a batch may take before the batch moves on without its result
+    _STEP_TIMEOUT = 30000
+
+    # Calls the queued functions in turn, each one gets a callback resolving its promise. A throw,
+    # a rejected promise or the step timer settle the promise in its place, later callbacks are ignored
+    _SCRIPT = """
+        var calls = arguments[0];
+        var stepTimeout = arguments[1];
+        var done = arguments[arguments.length - 1];
+        var results = [];
+        var next = function (i) {
+            if (i >= calls.length) {
+                done(results);
+                return;
+            }
+            new Promise(function (resolve, reject) {
+                var timer = setTimeout(function () {
+                    reject("no result after " + stepTimeout + " ms");
+                }, stepTimeout);
+                var settle = function (callback) {
+                    return function (value) {
+                        clearTimeout(timer);
+                        callback(value);
+                    };
+                };
+                try {
+                    var fn = window.WAPI[calls[i][0]];
+                    var returned = fn.apply(window.WAPI, calls[i][1].concat([settle(resolve)]));
+                    if (returned && typeof returned.then === "function") {
+                        returned.then(null, settle(reject));
+                    }
+                } catch (error) {
+                    settle(reject)(error);
+                }
+            }).then(function (result) {
+                results.push({result: result === undefined ? null : result});
+            }, function (error) {
+                results.push({error: String(error)});
+            }).then(function () {
+                next(i + 1);
+            });
+        };
+        next(0);
+    """
+
+    def __init__(self, driver, wapi_wrapper):
+        self.driver = driver
+        self.wapi_wrapper = wapi_wrapper
+        self.calls = []
+
+    def __getattr__(self, item):
+        """
+        Queues a call to a function in window.WAPI, ``batch.sendSeen(chat_id)`` is ``batch.add("sendSeen", chat_id)``
+
+        :param item: Function name
+        :return: Callable queueing the call
+        """
+        if item.startswith("_"):
+            raise AttributeError(item)
+        return lambda *args: self.add(item, *args)
+
+    def __len__(self):
+        return len(self.calls)
+
+    def add(self, function_name, *args):
+        """
+        Queues a call
+
+        :param function_name: Name of the function in window.WAPI
+        :param args: Arguments of the call, without the done callback
+        :return: Index of the call's result in the list returned by run
+        :rtype: int
+        """
+        if function_name not in dir(self.wapi_wrapper):
+            raise AttributeError("Function {0} doesn't exist".format(function_name))
+
+        self.calls.append([function_name, list(args)])
+        return len(self.calls) - 1
+
+    def run(self):
+        """
+        Runs all queued calls and empties the batch
+
+        :return: Result of each call in order. A call that threw in JS has a JsException instead
+        :rtype: list
+        """
+        calls, self.calls = self.calls, []
+        if not calls:
+            return []
+
+        try:
+            results = self._execute(calls)
+        except JavascriptException as e:
+            if "WAPI is not defined" not in e.msg:
+                raise JsException("Error in batch ({0}). Calls: {1}".format(e.msg, calls))
+            # Page was reloaded, inject wapi.js again and retry once
+            self.wapi_wrapper.available_functions = None
+            dir(self.wapi_wrapper)
+            results = self._execute(calls)
+
+        return [
+            JsException("Error in function {0} ({1})".format(call[0], result["error"]))
+            if "error" in result
+            else result["result"]
+            for call, result in zip(calls, results)
+        ]
+
+    def _execute(self, calls):
+        try:
+            return self.driver.execute_async_script(self._SCRIPT, calls, self._STEP_TIMEOUT)
+        except JavascriptException:
+            raise
+        except WebDriverException as e:
+            if e.msg == "Timed out":
+                raise WapiPhoneNotConnectedException("Phone not connected to Internet")
+            raise JsException("Error in batch ({0}). Calls: {1}".format(e.msg, calls))
+
+
 class NewMessagesObservable(Thread):
     def __init__(self, wapi_js_wrapper, wapi_driver, webdriver):
         Thread.__init__(self)
@@ -197,6 +335,8 @@ class NewMessagesObservable(Thread):
             )
 
         self.observers.append(observer)
+        if self.ident is None:
+            self.start()
 
     def unsubscribe(self, observer):
         self.observers.remove(observer)